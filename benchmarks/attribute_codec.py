@@ -0,0 +1,93 @@
+"""Compare AttributeStore redis codecs.
+
+Reports encode/decode cost and encoded size for typical attribute documents.
+With --redis, also stores each document and reports redis MEMORY USAGE.
+
+python -m benchmarks.attribute_codec [--redis] [--number 100000]
+"""
+import argparse
+import asyncio
+import json
+import timeit
+
+from dango import config
+from dango.plugins.common import serialization
+
+
+DOCUMENTS = {
+    "osu": {"osu_id": 2070907},
+    "battletag": {"blizzard_battletag": "khazhyk#1234"},
+    "resin": {"resin_count": 120, "resin_date": 1633046400.123},
+    "mentions": {"pm_mentions_mode": "always"},
+    "everything": {
+        "osu_id": 2070907,
+        "blizzard_battletag": "khazhyk#1234",
+        "resin_count": 120,
+        "resin_date": 1633046400.123,
+        "pm_mentions_mode": "always",
+    },
+}
+
+
+def legacy_json(doc):
+    return json.dumps(doc).encode('utf8')
+
+
+def bench_codecs(number):
+    rows = []
+    for doc_name, doc in DOCUMENTS.items():
+        encoders = [("legacy", legacy_json)] + [
+            (name, lambda d, c=codec: serialization.encode(d, c))
+            for name, codec in serialization.CODECS.items()]
+        for codec_name, encode in encoders:
+            encoded = encode(doc)
+            enc_t = timeit.timeit(lambda: encode(doc), number=number)
+            dec_t = timeit.timeit(lambda: serialization.decode(encoded), number=number)
+            rows.append((doc_name, codec_name, len(encoded),
+                         enc_t / number * 1e9, dec_t / number * 1e9))
+    return rows
+
+
+async def redis_memory_usage(conf):
+    from dango.plugins import redis
+
+    rds = redis.Redis(conf.root.add_group("redis"))
+    await rds.cog_load()
+    usage = {}
+    try:
+        async with rds.acquire() as conn:
+            for doc_name, doc in DOCUMENTS.items():
+                for codec_name, codec in serialization.CODECS.items():
+                    key = "spoo:bench:attribute:%s:%s" % (doc_name, codec_name)
+                    await conn.set(key, serialization.encode(doc, codec))
+                    usage[doc_name, codec_name] = await conn.memory_usage(key)
+                    await conn.delete(key)
+    finally:
+        await rds.cog_unload()
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--redis", action="store_true",
+                        help="measure MEMORY USAGE against the redis in --config")
+    parser.add_argument("--config", default="config.yml")
+    args = parser.parse_args()
+
+    usage = {}
+    if args.redis:
+        conf = config.FileConfiguration(args.config)
+        conf.load()
+        usage = asyncio.run(redis_memory_usage(conf))
+
+    print("%-12s %-8s %6s %10s %10s %8s" % (
+        "document", "codec", "bytes", "enc ns", "dec ns", "redis"))
+    for doc_name, codec_name, size, enc_ns, dec_ns in bench_codecs(args.number):
+        print("%-12s %-8s %6d %10.0f %10.0f %8s" % (
+            doc_name, codec_name, size, enc_ns, dec_ns,
+            usage.get((doc_name, codec_name), "-")))
+
+
+if __name__ == "__main__":
+    main()
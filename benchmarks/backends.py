@@ -0,0 +1,199 @@
+"""Database/Redis backends for benchmarks.
+
+The fakes expose the same acquire() interface as the Database and Redis cogs,
+so cogs under benchmark run their real code paths without services. They
+don't interpret SQL: writes report the rows they were given, reads find
+nothing. Redis is a dict. An optional per-call latency models round trips.
+"""
+import asyncio
+import fnmatch
+import re
+
+from dango import config
+
+
+class _Transaction:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class _EmptyCursor:
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+class FakeConnection:
+    """Stand-in asyncpg connection."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.statements = 0
+        self.rows_written = 0
+
+    async def _roundtrip(self):
+        self.statements += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def execute(self, query, *args, **kwargs):
+        await self._roundtrip()
+        if query.lstrip().upper().startswith(("INSERT", "UPDATE")):
+            rows = max(1, len(re.findall(r"\)\s*,\s*\(", query)) + 1) if args else 0
+            self.rows_written += rows
+            return "INSERT 0 %d" % rows
+        return "OK"
+
+    async def executemany(self, command, args, **kwargs):
+        await self._roundtrip()
+        self.rows_written += len(args)
+
+    async def copy_records_to_table(self, table_name, *, records, **kwargs):
+        await self._roundtrip()
+        records = list(records)
+        self.rows_written += len(records)
+        return "COPY %d" % len(records)
+
+    async def fetch(self, query, *args, **kwargs):
+        await self._roundtrip()
+        return []
+
+    async def fetchrow(self, query, *args, **kwargs):
+        await self._roundtrip()
+        return None
+
+    async def fetchval(self, query, *args, **kwargs):
+        await self._roundtrip()
+        return None
+
+    def transaction(self):
+        return _Transaction()
+
+    def cursor(self, query, *args, **kwargs):
+        return _EmptyCursor()
+
+
+class _Acquire:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeDatabase:
+    """Looks like the Database cog."""
+
+    def __init__(self, latency=0):
+        self.conn = FakeConnection(latency)
+
+    def acquire(self, readonly=False):
+        return _Acquire(self.conn)
+
+
+class FakeRedisClient:
+    """Dict backed subset of the aioredis client."""
+
+    def __init__(self, latency=0):
+        self.data = {}
+        self.latency = latency
+        self.commands = 0
+
+    async def _roundtrip(self):
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _key(key):
+        return key.encode('utf8') if isinstance(key, str) else key
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, str):
+            return value.encode('utf8')
+        if isinstance(value, (int, float)):
+            return str(value).encode('utf8')
+        return value
+
+    async def get(self, key):
+        await self._roundtrip()
+        return self.data.get(self._key(key))
+
+    async def set(self, key, value, **kwargs):
+        await self._roundtrip()
+        self.data[self._key(key)] = self._value(value)
+        return True
+
+    async def mget(self, keys, *args):
+        await self._roundtrip()
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        keys.extend(args)
+        return [self.data.get(self._key(key)) for key in keys]
+
+    async def mset(self, mapping):
+        await self._roundtrip()
+        for key, value in mapping.items():
+            self.data[self._key(key)] = self._value(value)
+        return True
+
+    async def delete(self, *keys):
+        await self._roundtrip()
+        return sum(self.data.pop(self._key(key), None) is not None for key in keys)
+
+    async def flushdb(self):
+        await self._roundtrip()
+        self.data.clear()
+        return True
+
+    async def scan(self, cursor=0, match=None, count=None):
+        await self._roundtrip()
+        match = match.decode('utf8') if isinstance(match, bytes) else match
+        keys = [k for k in self.data if not match or fnmatch.fnmatch(k.decode('utf8'), match)]
+        return 0, keys
+
+
+class FakeRedis:
+    """Looks like the Redis cog."""
+
+    def __init__(self, latency=0):
+        self.client = FakeRedisClient(latency)
+
+    def acquire(self):
+        return _Acquire(self.client)
+
+
+def fake_backends(latency=0):
+    return FakeDatabase(latency), FakeRedis(latency)
+
+
+async def real_backends(config_file):
+    """Database and Redis cogs configured from config_file, loaded."""
+    from dango.plugins import database
+    from dango.plugins import redis
+
+    conf = config.FileConfiguration(config_file)
+    conf.load()
+    db = database.Database(conf.root.add_group("database"))
+    rds = redis.Redis(conf.root.add_group("redis"))
+    await db.cog_load()
+    await rds.cog_load()
+    return db, rds
+
+
+async def close_backends(db, rds):
+    if hasattr(db, "cog_unload"):
+        await db.cog_unload()
+    if hasattr(rds, "cog_unload"):
+        await rds.cog_unload()
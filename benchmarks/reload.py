@@ -0,0 +1,89 @@
+"""Reload time after editing dango/plugins/common/utils.py.
+
+The watchdog maps any change under common/ to the dango.plugins.common
+extension, so this times reloading it with its dependants. Also shows which
+dependants the source scan finds compared to looking for module attributes.
+
+python -m benchmarks.reload [--runs 5] [--plugins dango.plugins.fun ...]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import types
+
+from dango import core
+from dango import extensions
+
+from benchmarks.startup import PLUGINS
+
+
+def attribute_deps(register, lib):
+    """Dependencies the way they were found before scanning source."""
+    deps = set()
+    for item in dir(lib):
+        val = getattr(lib, item)
+        if isinstance(val, types.ModuleType) and any(
+                extensions._is_submodule(r, val.__spec__.name) for r in register._reloadable):
+            deps.add(val.__spec__.name)
+    return deps
+
+
+def dependants(deps, name):
+    return sorted(key for key, deplist in deps.items()
+                  if key != name and any(extensions._is_submodule(name, d) for d in deplist))
+
+
+async def run(args, conf):
+    bot = core.DangoBot(conf=conf)
+    register = bot._loader._register
+    for plugin in ["dango.plugins.common"] + args.plugins:
+        await bot._loader.watch_spec(plugin)
+
+    target = "dango.plugins.common"
+    old = {name: attribute_deps(register, lib) for name, lib in bot.extensions.items()}
+    print("dependants of %s" % target)
+    print("  attributes: %s" % ", ".join(dependants(old, target)))
+    print("  imports:    %s" % ", ".join(dependants(register._deps, target)))
+
+    specs = [lib.__spec__ for lib in bot.extensions.values()]
+    start = time.perf_counter()
+    scanner = extensions.ImportScanner()
+    for spec in specs:
+        scanner.imports(spec)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for spec in specs:
+        scanner.imports(spec)
+    print("import scan of %d extensions: %.2fms cold, %.2fms cached" % (
+        len(specs), cold * 1000, (time.perf_counter() - start) * 1000))
+
+    times = []
+    for _ in range(args.runs):
+        # Bump the mtime like an editor save would.
+        os.utime(os.path.join(os.path.dirname(core.__file__), "plugins", "common", "utils.py"))
+        start = time.perf_counter()
+        reloaded = await register.reload_extension(target)
+        times.append(time.perf_counter() - start)
+    print("reload of %s: %d extensions, median %.3fs (min %.3fs, max %.3fs)" % (
+        target, len(reloaded), statistics.median(times), min(times), max(times)))
+    await bot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--plugins", nargs="+", default=PLUGINS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        conf = os.path.join(workdir, "config.yml")
+        with open(conf, "w", encoding="utf8") as f:
+            f.write("token: bench\nwaaai_api_key: bench\n")
+        asyncio.run(run(args, conf))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Replays a gateway trace into a DangoBot without a network connection.
+
+Record a trace with dango.extras.gateway_trace, then:
+
+python -m benchmarks.replay traces/gateway.X.trace.gz [--speed 1|N|max] [--backend real --config config.yml]
+
+Dispatches go through the bot's ConnectionState parsers just like the
+gateway's, so listeners see the same objects they would in production. REST
+calls are refused. Reports per-listener latency (dispatch to completion) and
+event loop lag; --json writes the same numbers for comparing runs.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from discord.ext import commands
+from discord import utils as discord_utils
+
+from dango import core
+from dango.extras import gateway_trace
+
+from benchmarks import backends
+
+PLUGINS = [
+    "dango.plugins.attributestore",
+    "dango.plugins.tracking",
+    "dango.extras.logging",
+    "dango.plugins.latency",
+    "dango.plugins.mentions",
+    "dango.plugins.metrics",
+]
+
+
+class ReplayOffline(Exception):
+    pass
+
+
+class FakeDatabaseCog(commands.Cog, name="Database"):
+
+    def __init__(self, db):
+        self.db = db
+
+    def acquire(self, readonly=False):
+        return self.db.acquire(readonly)
+
+
+class FakeRedisCog(commands.Cog, name="Redis"):
+
+    def __init__(self, rds):
+        self.rds = rds
+
+    def acquire(self):
+        return self.rds.acquire()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / (len(values) or 1),
+        "p50_ms": 1000 * percentile(values, 50),
+        "p99_ms": 1000 * percentile(values, 99),
+        "max_ms": 1000 * max(values, default=0),
+    }
+
+
+class ReplayBot(core.DangoBot):
+    """Times every scheduled listener from dispatch to completion."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listener_latency = collections.defaultdict(list)
+        self.listener_errors = collections.Counter()
+        self.rest_calls = collections.Counter()
+        self.pending = set()
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        queued = time.perf_counter()
+        name = getattr(coro, "__qualname__", event_name)
+
+        async def timed(*args, **kwargs):
+            try:
+                await coro(*args, **kwargs)
+            except Exception:
+                self.listener_errors[name] += 1
+                raise
+            finally:
+                self.listener_latency[name].append(time.perf_counter() - queued)
+
+        setattr(timed, core.LISTENER_LANE, getattr(coro, core.LISTENER_LANE, None))
+        task = super()._schedule_event(timed, event_name, *args, **kwargs)
+        if task is None:  # Dropped by a full lane
+            return None
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def offline_request(self, route, **kwargs):
+        self.rest_calls[route.method, route.path] += 1
+        raise ReplayOffline("%s %s" % (route.method, route.path))
+
+
+async def monitor_loop_lag(lags, interval=0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def write_config(args, workdir):
+    """A throwaway copy of the config, saves from cogs land there."""
+    conf_file = os.path.join(workdir, "config.yml")
+    if args.config:
+        shutil.copy(args.config, conf_file)
+    else:
+        with open(conf_file, "w", encoding="utf8") as f:
+            f.write("token: replay\nwaaai_api_key: replay\n")
+            f.write("logging:\n  log_dir: %s\n" % os.path.join(workdir, "logs"))
+    return conf_file
+
+
+async def make_bot(args, workdir):
+    bot = ReplayBot(
+        conf=write_config(args, workdir), chunk_guilds_at_startup=False,
+        guild_ready_timeout=0.5)
+    await bot._async_setup_hook()
+    bot.http.request = bot.offline_request
+
+    if args.backend == "real":
+        await bot.load_extension("dango.plugins.database")
+        await bot.load_extension("dango.plugins.redis")
+    else:
+        db, rds = backends.fake_backends(args.latency)
+        await bot.add_cog(FakeDatabaseCog(db))
+        await bot.add_cog(FakeRedisCog(rds))
+
+    for plugin in args.plugins:
+        await bot.load_extension(plugin)
+    return bot
+
+
+async def feed(bot, trace, speed, limit):
+    """Feeds dispatches the way DiscordWebSocket.received_message does."""
+    parsers = bot._connection.parsers
+    seen_ready = False
+    events = 0
+    start = time.perf_counter()
+    for offset, raw in trace:
+        if speed:
+            delay = start + offset / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        msg = discord_utils._from_json(raw)
+        event = msg.get('t')
+        if msg.get('op') != 0 or not event:
+            continue
+        bot.dispatch('socket_event_type', event)
+        if event == 'READY':
+            # Other shards' READY would clear the state, their guilds
+            # arrive as GUILD_CREATE regardless.
+            if seen_ready:
+                continue
+            seen_ready = True
+        func = parsers.get(event)
+        if func:
+            func(msg['d'])
+        events += 1
+        await asyncio.sleep(0)
+        if limit and events >= limit:
+            break
+    return events, time.perf_counter() - start
+
+
+def report(bot, events, feed_time, drain_time, lags):
+    listeners = {name: summarize(values) for name, values in bot.listener_latency.items()}
+    for name, errors in bot.listener_errors.items():
+        listeners[name]["errors"] = errors
+
+    print("%d dispatches in %.2fs (%.0f/s), %.2fs to drain listeners" % (
+        events, feed_time, events / (feed_time or 1e-9), drain_time))
+    print("%-45s %8s %9s %9s %9s %9s %6s" % (
+        "listener", "count", "mean ms", "p50 ms", "p99 ms", "max ms", "errors"))
+    for name, s in sorted(listeners.items(), key=lambda i: -i[1]["mean_ms"] * i[1]["count"]):
+        print("%-45s %8d %9.3f %9.3f %9.3f %9.3f %6d" % (
+            name[:45], s["count"], s["mean_ms"], s["p50_ms"], s["p99_ms"], s["max_ms"],
+            s.get("errors", 0)))
+
+    lag = summarize(lags)
+    print("event loop lag: p50 %.3fms, p99 %.3fms, max %.3fms" % (
+        lag["p50_ms"], lag["p99_ms"], lag["max_ms"]))
+    for name, lane in sorted(bot.lanes.items()):
+        print("lane %s: %d dropped" % (name, lane.dropped))
+    if bot.rest_calls:
+        print("refused %d REST calls" % sum(bot.rest_calls.values()))
+
+    return {
+        "dispatches": events,
+        "feed_seconds": feed_time,
+        "drain_seconds": drain_time,
+        "listeners": listeners,
+        "loop_lag": lag,
+        "lane_drops": {name: lane.dropped for name, lane in bot.lanes.items()},
+        "rest_calls": sum(bot.rest_calls.values()),
+    }
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="dango-replay-")
+    bot = await make_bot(args, workdir)
+    lags = []
+    lag_task = asyncio.ensure_future(monitor_loop_lag(lags))
+    try:
+        events, feed_time = await feed(
+            bot, gateway_trace.read_trace(args.trace), args.speed, args.events)
+        drain_start = time.perf_counter()
+        while bot.pending:
+            await asyncio.gather(*bot.pending, return_exceptions=True)
+        drain_time = time.perf_counter() - drain_start
+    finally:
+        lag_task.cancel()
+        await bot.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = report(bot, events, feed_time, drain_time, lags)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+
+def speed(value):
+    return 0 if value == "max" else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=speed, default=0,
+                        help="1 for real time, N times faster, or max (default)")
+    parser.add_argument("--events", type=int, default=0, help="stop after this many dispatches")
+    parser.add_argument("--plugins", nargs="+", default=PLUGINS)
+    parser.add_argument("--backend", choices=["fake", "real"], default="fake")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds of simulated round trip per fake backend call")
+    parser.add_argument("--config", help="bot config, needed for --backend real")
+    parser.add_argument("--json", help="write the summary here")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
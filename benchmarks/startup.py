@@ -0,0 +1,91 @@
+"""Cold start time and peak RSS, with and without lazy plugins.
+
+Each run is a fresh interpreter that builds a bot and loads the plugins
+(no gateway connection). The lazy run first builds the plugin manifest.
+
+python -m benchmarks.startup [--runs 3] [--plugins dango.plugins.fun ...]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PLUGINS = [
+    "dango.plugins.command_errors",
+    "dango.plugins.emote_stealer",
+    "dango.plugins.fun",
+    "dango.plugins.info",
+    "dango.plugins.meta",
+    "dango.plugins.resin",
+]
+
+
+async def load(args):
+    from dango import core
+
+    bot = core.DangoBot(conf=args.conf)
+    for plugin in args.plugins:
+        await bot._loader.watch_spec(plugin)
+    return len(bot.extensions), len(bot.all_commands)
+
+
+def child(args):
+    import asyncio
+
+    start = time.perf_counter()
+    extensions, commands = asyncio.run(load(args))
+    json.dump({
+        "seconds": time.perf_counter() - start,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "extensions": extensions,
+        "commands": commands,
+    }, sys.stdout)
+
+
+def write_config(workdir, lazy):
+    conf = os.path.join(workdir, "lazy.yml" if lazy else "eager.yml")
+    with open(conf, "w", encoding="utf8") as f:
+        f.write("token: bench\nwaaai_api_key: bench\n")
+        f.write("plugin_manifest: %s\n" % os.path.join(workdir, "manifest.json"))
+        f.write("lazy_plugins: %s\n" % json.dumps(["*"] if lazy else []))
+    return conf
+
+
+def run_child(conf, plugins):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", "--conf", conf,
+         "--plugins", *plugins],
+        check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--plugins", nargs="+", default=PLUGINS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--conf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        eager, lazy = write_config(workdir, False), write_config(workdir, True)
+        run_child(lazy, args.plugins)  # Builds the manifest
+
+        print("%-6s %10s %8s %11s %9s" % ("mode", "seconds", "rss MB", "extensions", "commands"))
+        for mode, conf in (("eager", eager), ("lazy", lazy)):
+            results = [run_child(conf, args.plugins) for _ in range(args.runs)]
+            print("%-6s %10.3f %8.1f %11d %9d" % (
+                mode, statistics.median(r["seconds"] for r in results),
+                statistics.median(r["rss_mb"] for r in results),
+                results[0]["extensions"], results[0]["commands"]))
+
+
+if __name__ == "__main__":
+    main()
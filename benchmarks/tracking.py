@@ -0,0 +1,137 @@
+"""Tracking and AttributeStore throughput.
+
+Drives the cogs through Database.acquire/Redis.acquire, against either
+in-process fakes (default) or the services in --config.
+
+python -m benchmarks.tracking [--events 100000] [--latency 0.0005] [--backend real]
+"""
+import argparse
+import asyncio
+import random
+import resource
+import time
+
+from dango import config
+import discord
+from dango.plugins import attributestore
+from dango.plugins import tracking
+
+from benchmarks import backends
+
+
+def dobject():
+    return discord.Object(random.randint(1 << 10, 1 << 58))
+
+
+def user():
+    m = dobject()
+    m.name = str(random.randint(1 << 20, 1 << 30))
+    return m
+
+
+def member(user_override=None, guild_override=None):
+    m = user_override or user()
+    m.guild = guild_override or dobject()
+    m.nick = None if random.randint(0, 3) > 2 else str(random.randint(1 << 20, 1 << 30))
+    return m
+
+
+def members(count, guilds=100):
+    guild_list = [dobject() for _ in range(guilds)]
+    return [member(guild_override=random.choice(guild_list)) for _ in range(count)]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Result:
+
+    def __init__(self, name, events, queue_time, flush_time):
+        self.name = name
+        self.events = events
+        self.queue_time = queue_time
+        self.flush_time = flush_time
+
+    def row(self):
+        total = self.queue_time + self.flush_time
+        return "%-12s %9d %12.0f %10.3f %12.0f %8.1f" % (
+            self.name, self.events, self.events / (self.queue_time or 1e-9),
+            self.flush_time, self.events / (total or 1e-9), peak_rss_mb())
+
+
+async def bench_presence(cog, events):
+    start = time.perf_counter()
+    for m in events:
+        cog.queue_batch_last_spoke_update(m)
+        cog.queue_batch_last_update(m)
+    queued = time.perf_counter()
+    await cog.do_batch_presence_update()
+    return Result("presence", len(events), queued - start, time.perf_counter() - queued)
+
+
+async def bench_names(cog, events):
+    start = time.perf_counter()
+    for m in events:
+        cog.queue_batch_names_update(m)
+    queued = time.perf_counter()
+    await cog.do_batch_names_update()
+    return Result("names", len(events), queued - start, time.perf_counter() - queued)
+
+
+async def bench_attributes(attr, events, working_set=2048):
+    hot = events[:working_set]
+    start = time.perf_counter()
+    for idx, m in enumerate(events):
+        target = hot[idx % len(hot)]
+        if idx % 10 == 0:
+            await attr.set_attributes(target, osu_id=idx)
+        else:
+            await attr.get_attribute(target, "osu_id")
+    return Result("attributes", len(events), time.perf_counter() - start, 0)
+
+
+async def run(args):
+    if args.backend == "real":
+        db, rds = await backends.real_backends(args.config)
+    else:
+        db, rds = backends.fake_backends(args.latency)
+
+    conf = config.StringConfiguration("")
+    cog = tracking.Tracking(None, conf.root.add_group("tracking"), db, rds)
+    attr = attributestore.AttributeStore(conf.root.add_group("attribute_store"), db, rds)
+    attr.register_mapping(discord.Object, 'member')
+    await asyncio.sleep(0)  # Let Tracking's batch tasks start, so they can be cancelled.
+
+    events = members(args.events)
+    print("%-12s %9s %12s %10s %12s %8s" % (
+        "scenario", "events", "queue ev/s", "flush s", "total ev/s", "rss MB"))
+    try:
+        for bench in (bench_presence, bench_names):
+            print((await bench(cog, events)).row())
+        print((await bench_attributes(attr, events[:args.attribute_ops])).row())
+    finally:
+        await cog.cog_unload()
+        await backends.close_backends(db, rds)
+
+    if args.backend == "fake":
+        print("database statements: %d, rows written: %d, redis commands: %d" % (
+            db.conn.statements, db.conn.rows_written, rds.client.commands))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--attribute-ops", type=int, default=100000)
+    parser.add_argument("--backend", choices=["fake", "real"], default="fake")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds of simulated round trip per fake call")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
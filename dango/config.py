@@ -61,30 +61,61 @@ On configuration side, we'll have:
 
 
 """
-import copy
 import io
+import logging
+import os
 import ruamel.yaml
 
+log = logging.getLogger(__name__)
+
 
 class InvalidConfig(Exception):
     pass
 
 
 class ConfigEntry:
-    """Descriptor tied to a config."""
+    """Descriptor tied to a config.
+
+    The value is looked up once per config generation, so reading it is
+    cheap. A reload moves every entry to the new data at once, then calls
+    the on_change callbacks of entries whose value changed.
+    """
 
     def __init__(self, config, default=None, validator=None, path=None):
         self._config = config
         self._path = path
         self.default = default
+        self._generation = None
+        self._value = None
+        self._callbacks = []
 
     @property
     def value(self):
-        return self._config.get(self._path)
+        if self._generation != self._config.generation:
+            self._value = self._config.get(self._path)
+            self._generation = self._config.generation
+        return self._value
 
     def __call__(self):
         return self.value
 
+    def on_change(self, callback):
+        """Call callback(new_value) when a reload changes this value.
+
+        Runs synchronously, start a task for anything async. Usable as a
+        decorator.
+        """
+        self.value  # Remember what it's changing from
+        self._callbacks.append(callback)
+        return callback
+
+    def _changed(self, value):
+        for callback in list(self._callbacks):
+            try:
+                callback(value)
+            except Exception:
+                log.exception("Config change callback for %s failed", ".".join(self._path))
+
 
 class ConfigGroup:
     def __init__(self, config, path=None):
@@ -107,12 +138,27 @@ class ConfigGroup:
     def add_group(self, group_name):
         group = ConfigGroup(self._config, self._path + [group_name])
         self._entries[group_name] = group
-        self.validate()
+        self._validate_entry(self._config.get(self._path), group_name, group)
         return group
 
     def remove_group(self, group_name):
         del self._entries[group_name]
-        self.validate()
+
+    def _validate_entry(self, data, key, entry):
+        if key in data and data[key] is not None:
+            return True
+        self._config.dirty = True
+        self._config.generation += 1
+        if isinstance(entry, ConfigGroup):
+            data[key] = self._config._yaml.map()
+        elif entry.default is not None:
+            data[key] = entry.default
+            data.yaml_add_eol_comment("Default value", key)
+        else:
+            data[key] = None
+            data.yaml_add_eol_comment("Required value", key)
+            return False
+        return True
 
     def validate(self):
         """Raise if configuration is not valid.
@@ -124,23 +170,34 @@ class ConfigGroup:
         valid = True
 
         for key, entry in self._entries.items():
-            if key not in data or data[key] is None:
-                if isinstance(entry, ConfigGroup):
-                    data[key] = self._config._yaml.map()
-                elif entry.default is not None:
-                    data[key] = entry.default
-                    data.yaml_add_eol_comment("Default value", key)
-                else:
-                    data[key] = None
-                    data.yaml_add_eol_comment("Required value", key)
-                    valid = False
+            if not self._validate_entry(data, key, entry):
+                valid = False
         return valid
 
+    def revalidate(self):
+        """Validate this group and every group below it, after a reload."""
+        self.validate()
+        for entry in self._entries.values():
+            if isinstance(entry, ConfigGroup):
+                entry.revalidate()
+
+    def watched(self):
+        """Entries with change callbacks, in this group and below."""
+        for entry in self._entries.values():
+            if isinstance(entry, ConfigGroup):
+                yield from entry.watched()
+            elif entry._callbacks:
+                yield entry
+
 
 class Configuration:
     def __init__(self):
         self._yaml = ruamel.yaml.YAML()
         self.root = ConfigGroup(self)
+        # Set when data changed since it was last loaded or saved.
+        self.dirty = False
+        # Bumped whenever data changes, invalidating cached entry values.
+        self.generation = 0
 
     def get(self, path):
         cur = self._data
@@ -149,6 +206,27 @@ class Configuration:
             path = path[1:]
         return cur
 
+    def set(self, path, value):
+        """Change a value, notifying anything watching it."""
+        previous = self._snapshot()
+        self.get(path[:-1])[path[-1]] = value
+        self.dirty = True
+        self.generation += 1
+        self._notify(previous)
+
+    def _snapshot(self):
+        return [(entry, entry.value) for entry in self.root.watched()]
+
+    def _notify(self, previous):
+        """Call back entries whose value differs from the snapshot."""
+        for entry, old in previous:
+            try:
+                new = entry.value
+            except (KeyError, TypeError):
+                continue  # Its group is gone from the data
+            if new != old:
+                entry._changed(new)
+
     def dumps(self):
         buff = io.StringIO()
         data = self._data.copy()
@@ -171,18 +249,44 @@ class FileConfiguration(Configuration):
     def __init__(self, filename):
         super().__init__()
         self._filename = filename
+        self._stat = None
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self._filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
     def load(self):
+        """Parse the file, unless it hasn't changed since we last read or wrote it."""
+        stat = self._file_stat()
+        if hasattr(self, "_data") and stat == self._stat:
+            return
+        previous = self._snapshot() if hasattr(self, "_data") else []
         try:
             with open(self._filename, encoding="utf8") as f:
-                self._data = self._yaml.load(f.read())
+                data = self._yaml.load(f.read()) or self._yaml.map()
         except FileNotFoundError:
-            self._data = self._yaml.map()
+            data = self._yaml.map()
+        # Only swap in data that parsed.
+        self._data = data
+        self._stat = stat
+        self.dirty = False
+        self.generation += 1
+        # Entries registered before the reload may be missing from the file.
+        self.root.revalidate()
+        self._notify(previous)
 
     def save(self):
+        """Write the file, if anything changed."""
+        if not self.dirty:
+            return
+        data = self._data.copy()
+        for key, val in self._data.items():
+            if isinstance(val, dict) and not val:
+                del data[key]
         with open(self._filename, 'w', encoding="utf8") as f:
-            data = copy.deepcopy(self._data)
-            for key, val in self._data.items():
-                if isinstance(val, dict) and not val:
-                    del data[key]
             self._yaml.dump(data, f)
+        self._stat = self._file_stat()
+        self.dirty = False
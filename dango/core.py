@@ -1,11 +1,15 @@
+import asyncio
 import collections
+import contextlib
 import datetime
+import functools
 import importlib
 import logging
 import os
 import io
 import sys
 import re
+import time
 
 import discord
 from discord.ext import commands
@@ -13,12 +17,22 @@ from discord.utils import cached_property
 
 from . import config
 from . import extensions
+from . import lanes
+from . import profiling
 from . import utils
 
 log = logging.getLogger(__name__)
 
 PLUGIN_DESC = "__dango_plugin_desc__"
 COG_DESC = "__dango_cog_desc__"
+# Optional cog methods to hand state to the next instance across a reload.
+STATE_EXPORT = "__dango_export_state__"
+STATE_IMPORT = "__dango_import_state__"
+# (lane, max_concurrency) of listeners declared with Cog.listener(lane=...).
+LISTENER_LANE = "__dango_lane__"
+DEFAULT_LANE_CONCURRENCY = 4
+# Seconds without a cog load before writing back config defaults.
+CONFIG_SAVE_DELAY = 1
 
 
 def dcog(depends=None, pass_bot=False):
@@ -31,7 +45,54 @@ def dcog(depends=None, pass_bot=False):
     return real_decorator
 
 class Cog(commands.Cog):
-    pass
+
+    @classmethod
+    def listener(cls, name=discord.utils.MISSING, lane=None, max_concurrency=None):
+        """commands.Cog.listener, optionally running in a bounded lane.
+
+        Listeners sharing a lane run at most max_concurrency (set by the first
+        to declare the lane, default DEFAULT_LANE_CONCURRENCY) at a time, and
+        further events queue, see lanes.ListenerLane. Other listeners and
+        command processing are still scheduled straight away.
+        """
+        decorator = super().listener(name)
+        if lane is None:
+            return decorator
+
+        def lane_decorator(func):
+            func = decorator(func)
+            actual = func.__func__ if isinstance(func, staticmethod) else func
+            setattr(actual, LISTENER_LANE, (lane, max_concurrency))
+            return func
+        return lane_decorator
+
+
+def dcog_classes(lib):
+    """dcog classes found in a module."""
+    for item in dir(lib):  # TODO - inspect.members
+        val = getattr(lib, item)
+        if isinstance(val, type) and hasattr(val, PLUGIN_DESC):
+            yield val
+
+
+def describe_extension(lib):
+    """What a plugin manifest needs to know about an extension.
+
+    An extension can only be loaded lazily if nothing it does matters until
+    one of its commands is used: no listeners, no cog_load, no setup.
+    """
+    cogs = []
+    cmds = []
+    lazy = not hasattr(lib, 'setup')
+    for cls in dcog_classes(lib):
+        cogs.append({"name": cls.__name__, "depends": list(getattr(cls, PLUGIN_DESC).depends)})
+        if cls.__cog_listeners__ or cls.cog_load is not commands.Cog.cog_load:
+            lazy = False
+        for cmd in cls.__cog_commands__:
+            if cmd.parent is None:
+                cmds.append({"name": cmd.name, "aliases": list(cmd.aliases),
+                             "help": cmd.short_doc})
+    return {"cogs": cogs, "commands": cmds, "lazy": lazy}
 
 
 def _is_submodule(parent, child):
@@ -48,7 +109,106 @@ def force_unload(name):
 
 
 PluginDesc = collections.namedtuple("PluginDesc", "depends pass_bot")
-CogDesc = collections.namedtuple("PluginDesc", "load_time")
+CogDesc = collections.namedtuple("PluginDesc", "load_time load_duration")
+
+
+class CogDependencyRegister:
+    """Dependency graph of cogs, by cog name.
+
+    Every dcog we've seen, loaded or deferred, is a node with edges to the
+    cogs it depends on and back. Each keeps a count of its dependencies that
+    aren't loaded, so loading or unloading a cog only visits its neighbours.
+    """
+
+    def __init__(self):
+        self.depends = {}  # name -> dependency names
+        self.dependants = collections.defaultdict(set)  # name -> names depending on it
+        self.unmet = {}  # name -> number of dependencies not loaded
+        self.loaded = set()
+        self.deferred = {}  # name -> dcog class waiting on dependencies
+
+    def add(self, name, depends):
+        """Register (or re-register) a dcog's dependencies."""
+        self._drop_edges(name)
+        self.depends[name] = tuple(depends)
+        for dep in self.depends[name]:
+            self.dependants[dep].add(name)
+        self.unmet[name] = sum(dep not in self.loaded for dep in self.depends[name])
+
+    def _drop_edges(self, name):
+        for dep in self.depends.pop(name, ()):
+            self.dependants[dep].discard(name)
+            if not self.dependants[dep]:
+                del self.dependants[dep]
+        self.unmet.pop(name, None)
+
+    def defer(self, cls):
+        self.deferred[cls.__name__] = cls
+
+    def forget(self, name):
+        """Drop a cog that is neither loaded nor wanted anymore."""
+        self.deferred.pop(name, None)
+        if name not in self.loaded:
+            self._drop_edges(name)
+
+    def mark_loaded(self, name):
+        """Returns the deferred cogs that can load now."""
+        self.loaded.add(name)
+        ready = []
+        for dependant in self.dependants.get(name, ()):
+            self.unmet[dependant] -= 1
+            if not self.unmet[dependant] and dependant in self.deferred:
+                ready.append(self.deferred.pop(dependant))
+        return ready
+
+    def mark_unloaded(self, name):
+        self.loaded.discard(name)
+        for dependant in self.dependants.get(name, ()):
+            self.unmet[dependant] += 1
+
+    def unload_order(self, name):
+        """Loaded cogs depending on name, directly or not, dependants first."""
+        order = []
+        seen = {name}
+        stack = [(name, iter(self.dependants.get(name, ())))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in seen and child in self.loaded:
+                    seen.add(child)
+                    stack.append((child, iter(self.dependants.get(child, ()))))
+                    break
+            else:
+                stack.pop()
+                if node != name:
+                    order.append(node)
+        return order
+
+    def cycles(self):
+        """Lists dependency cycles between registered cogs."""
+        cycles = []
+        state = {}  # name -> 1 visiting, 2 done
+        for root in self.depends:
+            if root in state:
+                continue
+            state[root] = 1
+            path = [root]
+            stack = [iter(self.depends[root])]
+            while stack:
+                for dep in stack[-1]:
+                    if dep not in self.depends:
+                        continue
+                    if state.get(dep) == 1:
+                        cycles.append(path[path.index(dep):] + [dep])
+                    elif dep not in state:
+                        state[dep] = 1
+                        path.append(dep)
+                        stack.append(iter(self.depends[dep]))
+                        break
+                else:
+                    state[path.pop()] = 2
+                    stack.pop()
+        return cycles
 
 
 class DangoContext(commands.Context):
@@ -85,6 +245,7 @@ class DangoContext(commands.Context):
 class DangoBotBase(commands.bot.BotBase):
 
     def __init__(self, *args, conf="config.yml", intents=discord.Intents.all(), **kwargs):
+        self.startup_profile = profiling.StartupProfile()
         self._config = config.FileConfiguration(conf)
         self._config.load()
         cgroup = self._config.root
@@ -94,13 +255,26 @@ class DangoBotBase(commands.bot.BotBase):
             self.plugins = cgroup.register("plugins", default="dango.plugins.*")
             self.waaai_api_key = cgroup.register("waaai_api_key")
             self._is_bot = cgroup.register("bot", default=True).value
+            # Extensions (fnmatch patterns) to import on first command use.
+            self.lazy_plugins = cgroup.register("lazy_plugins", default=[])
+            self.plugin_manifest = cgroup.register("plugin_manifest", default="plugin_manifest.json")
         finally:
             # Raise and fail to start on invalid core config
             self._config.save()
 
-        self._loader = extensions.WatchdogExtensionLoader(self)
-        self._dango_unloaded_cogs = {}
+        self._loader = extensions.WatchdogExtensionLoader(
+            self, lazy=self.lazy_plugins(), manifest=self.plugin_manifest())
+        self._cog_deps = CogDependencyRegister()
+        self._config_save_handle = None
+        self._cog_state = None  # cog name -> exported state, during a handoff
+        self.lanes = {}  # name -> lanes.ListenerLane
         super().__init__(self.prefix.value, *args, self_bot=not self._is_bot, intents=intents, **kwargs)
+        self.add_listener(self._record_ready, "on_ready")
+
+    async def _record_ready(self):
+        self.startup_profile.mark_ready()
+        self.remove_listener(self._record_ready, "on_ready")
+        log.info("Ready %.3fs after startup", self.startup_profile.ready)
 
     async def start(self, *args, **kwargs):
         if isinstance(self.plugins(), str):
@@ -108,6 +282,7 @@ class DangoBotBase(commands.bot.BotBase):
         else:
             for plugin_dir in self.plugins():
                 await self._loader.watch_spec(plugin_dir)
+        self._loader.watch_file(self._config._filename, self._reload_config)
         self._loader.start()
         await super().start(self.token.value, *args, **kwargs)
 
@@ -116,9 +291,57 @@ class DangoBotBase(commands.bot.BotBase):
             "Unhandled exception in %s\nargs: %s\nkwargs: %s\n",
             event, args, kwargs)
 
+    def add_listener(self, func, name=discord.utils.MISSING):
+        lane = getattr(func, LISTENER_LANE, None)
+        if lane:
+            self._lane(*lane)
+        super().add_listener(func, name)
+
+    def _lane(self, name, max_concurrency):
+        lane = self.lanes.get(name)
+        if lane is None:
+            lane = self.lanes[name] = lanes.ListenerLane(
+                name, max_concurrency or DEFAULT_LANE_CONCURRENCY)
+        elif max_concurrency and max_concurrency != lane.max_concurrency:
+            log.warning("Lane %s already runs %d listeners at once, ignoring %d",
+                        name, lane.max_concurrency, max_concurrency)
+        return lane
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        lane = getattr(coro, LISTENER_LANE, None)
+        if lane is None:
+            return super()._schedule_event(coro, event_name, *args, **kwargs)
+        return self._lane(*lane).submit(functools.partial(
+            super()._schedule_event, coro, event_name, *args, **kwargs))
+
     def get_context(self, message):
         return super().get_context(message, cls=DangoContext)
 
+    @property
+    def _dango_unloaded_cogs(self):
+        return self._cog_deps.deferred
+
+    @contextlib.contextmanager
+    def state_handoff(self):
+        """Hand cog state across the reloads done inside this block.
+
+        Cogs unloaded in the block pass whatever __dango_export_state__()
+        returns to __dango_import_state__(state) on the instance of the same
+        name loaded later in the block, before its cog_load. Export runs
+        before cog_unload, so a cog can hand over its queues instead of
+        flushing them. State nobody picked up is dropped with a warning.
+        """
+        if self._cog_state is not None:
+            yield
+            return
+        self._cog_state = {}
+        try:
+            yield
+        finally:
+            leftover, self._cog_state = self._cog_state, None
+            for name in leftover:
+                log.warning("Dropping state of %s, it wasn't loaded again", name)
+
     async def add_cog(self, cls):
         """Tries to load a cog.
 
@@ -127,12 +350,25 @@ class DangoBotBase(commands.bot.BotBase):
         desc = getattr(cls, PLUGIN_DESC, None)
         if not desc:
             log.debug("Loading cog %s", cls)
-            return await super().add_cog(cls)
-
+            await super().add_cog(cls)
+            ready = self._cog_deps.mark_loaded(cls.qualified_name)
+        else:
+            ready = [cls]
+
+        # Loading a cog may let deferred ones load, which may let others...
+        while ready:
+            cls = ready.pop()
+            if await self._add_dcog(cls):
+                ready.extend(self._cog_deps.mark_loaded(cls.__name__))
+
+    async def _add_dcog(self, cls):
+        """Load a dcog if its dependencies are loaded, otherwise defer it."""
+        desc = getattr(cls, PLUGIN_DESC)
+        self._cog_deps.add(cls.__name__, desc.depends)
         depends = [self.get_cog(name) for name in desc.depends]
         if not all(depends):
-            self._dango_unloaded_cogs[cls.__name__] = cls
-            return
+            self._cog_deps.defer(cls)
+            return False
 
         self._config.load()
         cgroup = self._config.root.add_group(utils.snakify(cls.__name__))
@@ -141,21 +377,50 @@ class DangoBotBase(commands.bot.BotBase):
         if desc.pass_bot:
             depends.insert(0, self)
 
+        start = time.perf_counter()
         try:
             cog = cls(*depends)
         except config.InvalidConfig:
+            self._config.save()
             raise
         finally:
+            self._schedule_config_save()
+        self._import_state(cls.__name__, cog)
+        constructed = time.perf_counter()
+        await super().add_cog(cog)  # Runs cog_load
+        loaded = time.perf_counter()
+        self.startup_profile.constructors[cls.__name__] = constructed - start
+        self.startup_profile.cog_loads[cls.__name__] = loaded - constructed
+        setattr(cog, COG_DESC, CogDesc(datetime.datetime.utcnow(), loaded - start))
+        log.debug("Loaded dcog %s.%s in %.3fs (constructor %.3fs)", cls.__module__,
+                  cls.__name__, loaded - start, constructed - start)
+        return True
+
+    def _reload_config(self):
+        """Pick up edits to the config file, see ConfigEntry.on_change."""
+        try:
+            self._config.load()
+        except Exception:
+            log.exception("Failed to reload config, keeping the old values")
+            return
+        # Reloading restores defaults that were removed from the file.
+        self._schedule_config_save()
+
+    def _schedule_config_save(self):
+        """Coalesce config writes from a wave of cog loads into one."""
+        if self._config_save_handle:
+            self._config_save_handle.cancel()
+            self._config_save_handle = None
+        if self._config.dirty:
+            self._config_save_handle = asyncio.get_running_loop().call_later(
+                CONFIG_SAVE_DELAY, self._save_config)
+
+    def _save_config(self):
+        self._config_save_handle = None
+        try:
             self._config.save()
-        await super().add_cog(cog)
-        setattr(cog, COG_DESC, CogDesc(datetime.datetime.utcnow()))
-        log.debug("Loaded dcog %s.%s", cls.__module__, cls.__name__)
-
-        # Try loading previously unloaded plugins.
-        unloaded_plugins = self._dango_unloaded_cogs
-        self._dango_unloaded_cogs = {}
-        for plugin in unloaded_plugins.values():
-            await self.add_cog(plugin)
+        except Exception:
+            log.exception("Failed to save config")
 
     async def remove_cog(self, name, remove=True):
         """Unloads a cog.
@@ -165,64 +430,155 @@ class DangoBotBase(commands.bot.BotBase):
         """
         cog = self.cogs.get(name, None)
 
+        if not cog:
+            if remove:
+                self._cog_deps.forget(name)
+            return
+
+        if hasattr(cog, PLUGIN_DESC):
+            for dependant in self._cog_deps.unload_order(name):
+                await self._unload_cog(dependant, defer=True)
+        await self._unload_cog(name, defer=not remove)
         if remove:
-            if name in self._dango_unloaded_cogs:
-                del self._dango_unloaded_cogs[name]
-        elif cog:
-            self._dango_unloaded_cogs[name] = type(cog)
+            self._cog_deps.forget(name)
 
-        if not cog:
+    def _import_state(self, name, cog):
+        if not self._cog_state or name not in self._cog_state or not hasattr(cog, STATE_IMPORT):
+            return
+        state = self._cog_state.pop(name)
+        try:
+            getattr(cog, STATE_IMPORT)(state)
+        except Exception:
+            log.exception("Failed to import state into %s, starting it cold", name)
+
+    def _export_state(self, name, cog):
+        if self._cog_state is None or not hasattr(cog, STATE_EXPORT):
             return
+        try:
+            state = getattr(cog, STATE_EXPORT)()
+        except Exception:
+            log.exception("Failed to export state from %s", name)
+            return
+        if state is not None:
+            self._cog_state[name] = state
 
+    async def _unload_cog(self, name, defer):
+        cog = self.cogs[name]
+        self._export_state(name, cog)
         if hasattr(cog, PLUGIN_DESC):
-            await self.unload_cog_deps(cog)
             self._config.root.remove_group(utils.snakify(name))
-
         await super().remove_cog(name)
+        self._cog_deps.mark_unloaded(name)
+        if defer and hasattr(cog, PLUGIN_DESC):
+            self._cog_deps.defer(type(cog))
         log.debug("Unloaded dcog %s", name)
 
-    async def unload_cog_deps(self, unloading_cog):
-        for cog_name, cog_inst in self.cogs.copy().items():
-            desc = getattr(cog_inst, PLUGIN_DESC, None)
-            if not desc:
-                continue
-
-            if type(unloading_cog).__name__ in desc.depends:
-                await self.remove_cog(cog_name, remove=False)
-
     async def load_extension(self, name):
         """Override load extension to auto-detect dcogs."""
-        if name in self.extensions:
-            return
+        failed = await self.load_extensions([name])
+        if name in failed:
+            raise failed[name]
 
-        log.info("Loading extension %s", name)
-        # Just in case we previously failed to unload this module, force unload it
-        force_unload(name)
-        lib = importlib.import_module(name)
+    async def load_extensions(self, names):
+        """Load several extensions, loading their dcogs concurrently.
 
-        for item in dir(lib):  # TODO - inspect.members
-            val = getattr(lib, item)
-            if isinstance(val, type) and hasattr(val, PLUGIN_DESC):
-                await self.add_cog(val)
+        Cogs load in waves, each wave being every cog whose dependencies are
+        loaded, so startup takes as long as the longest chain of cog_loads
+        instead of all of them.
 
-        setup = getattr(lib, 'setup', None)
-        if setup:
-            await discord.utils.maybe_coroutine(setup, self)
+        Returns a dict of extension name to exception for those that failed.
+        """
+        libs = {}
+        failed = {}
+        with self.startup_profile.import_timer():
+            for name in names:
+                if name in self.extensions or name in libs:
+                    continue
+                log.info("Loading extension %s", name)
+                # Just in case we previously failed to unload this module, force unload it
+                force_unload(name)
+                try:
+                    libs[name] = importlib.import_module(name)
+                except Exception as e:
+                    failed[name] = e
+
+        pending = {}  # cog class -> extension name
+        for name, lib in libs.items():
+            for cls in dcog_classes(lib):
+                pending.setdefault(cls, name)
+
+        # Kahn's algorithm over the cogs in this batch, a wave per level.
+        by_name = {cls.__name__: cls for cls in pending}
+        indegree = {}
+        batch_dependants = collections.defaultdict(list)
+        for cls in pending:
+            deps = {dep for dep in getattr(cls, PLUGIN_DESC).depends
+                    if dep in by_name and not self.get_cog(dep)}
+            indegree[cls] = len(deps)
+            for dep in deps:
+                batch_dependants[dep].append(cls)
+
+        start = time.perf_counter()
+        waves = 0
+        wave = [cls for cls, count in indegree.items() if not count]
+        while wave:
+            waves += 1
+            results = await asyncio.gather(
+                *(self.add_cog(cls) for cls in wave), return_exceptions=True)
+            next_wave = []
+            for cls, result in zip(wave, results):
+                name = pending.pop(cls)
+                if isinstance(result, BaseException):
+                    failed.setdefault(name, result)
+                    continue
+                for dependant in batch_dependants[cls.__name__]:
+                    indegree[dependant] -= 1
+                    if not indegree[dependant]:
+                        next_wave.append(dependant)
+            wave = next_wave
+        if waves:
+            log.info("Loaded cogs in %d waves in %.3fs", waves, time.perf_counter() - start)
+
+        # Whatever is left is on a cycle or needs a cog that failed, add_cog
+        # defers them.
+        for cls, name in pending.items():
+            try:
+                await self.add_cog(cls)
+            except Exception as e:
+                failed.setdefault(name, e)
+        if pending:
+            for cycle in self._cog_deps.cycles():
+                log.error("Cog dependency cycle: %s", " -> ".join(cycle))
+
+        for name, lib in libs.items():
+            if name in failed:
+                continue
+            setup = getattr(lib, 'setup', None)
+            try:
+                if setup:
+                    await discord.utils.maybe_coroutine(setup, self)
+            except Exception as e:
+                failed[name] = e
+                continue
+            self._BotBase__extensions[name] = lib
 
-        self._BotBase__extensions[name] = lib
+        return failed
 
     def unload_extension(self, name):
         """Override unload extension to cleanup cog dependencies."""
         removelist = []
-        for k, v in self._dango_unloaded_cogs.items():
+        for k, v in self._cog_deps.deferred.items():
             if _is_submodule(name, v.__module__):
                 removelist.append(k)
         for k in removelist:
-            del self._dango_unloaded_cogs[k]
+            self._cog_deps.forget(k)
 
         return super().unload_extension(name)
 
     async def close(self):
+        if self._config_save_handle:
+            self._config_save_handle.cancel()
+        self._save_config()
         self._loader.close()
         return await super().close()
 
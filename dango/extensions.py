@@ -1,77 +1,360 @@
+import ast
 import asyncio
 import collections
+import fnmatch
+import json
 import logging
 import os
 import time
-import types
 import threading
 import sys
 import importlib
+import importlib.util
+from discord.ext import commands
 from discord.ext.commands import errors
 from watchdog import events
 from watchdog import observers
 
 from . import config
+from . import core
 
 log = logging.getLogger(__name__)
 
+# Seconds without filesystem events before reloading what changed.
+RELOAD_QUIET_PERIOD = 0.5
+# Reload anyway this long after the first event of a burst.
+RELOAD_MAX_DELAY = 5
+
 
 def _is_submodule(parent, child):
     return parent == child or child.startswith(parent + ".")
 
 
 class ModuleDirWatchdog(events.FileSystemEventHandler):
+    """Forwards filesystem events for a watched directory to a ReloadQueue.
 
-    def __init__(self, register, module_lookup, loop=None):
-        self._register = register
+    Runs on the observer thread, so it only enqueues.
+    """
+
+    def __init__(self, reloads, module_lookup):
+        self._reloads = reloads
         self.module_lookup = module_lookup
-        self.loop = loop or asyncio.get_event_loop()
-        self.debounce = collections.defaultdict(int)
         super().__init__()
 
-    def _call(self, coro):
-        fut = asyncio.run_coroutine_threadsafe(
-            coro,
-            loop=self.loop)
-        return fut.result()
-
-    async def _unload(self, mod_to_unload):
-        await self._register.unload_extension(mod_to_unload)
-
-    async def _try_reload(self, mod_to_reload):
-        now = time.time()
-        if self.debounce[mod_to_reload] + 2 > now:
-            log.warning("Debouncing reloading of %s", mod_to_reload)
-            return
-        self.debounce[mod_to_reload] = now
-        try:
-            log.info("Reloading %s", mod_to_reload)
-            await self._register.reload_extension(mod_to_reload)
-        except BaseException:
-            log.exception("Failed to reload! %s", mod_to_reload)
-
     def on_created(self, event):
         mod_to_reload = self.module_lookup(event)
         if mod_to_reload:
             log.info("Detected creation of %s, loading...", event.src_path)
-            self._call(self._try_reload(mod_to_reload))
+            self._reloads.put(mod_to_reload)
 
     def on_deleted(self, event):
         mod_to_reload = self.module_lookup(event)
         if mod_to_reload:
             log.info("Detected deletion of %s, unloading...", event.src_path)
-            self._call(self._unload(mod_to_reload))
+            self._reloads.put(mod_to_reload, deleted=True)
 
     def on_modified(self, event):
         mod_to_reload = self.module_lookup(event)
         if mod_to_reload:
             log.info("Detected change to %s, reloading...", event.src_path)
-            self._call(self._try_reload(mod_to_reload))
+            self._reloads.put(mod_to_reload)
 
     def on_moved(self, event):
         pass
 
 
+class FileWatchdog(events.FileSystemEventHandler):
+    """Calls callback on the loop whenever a single file is written or replaced."""
+
+    def __init__(self, path, callback, loop):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.loop = loop
+        super().__init__()
+
+    def _check(self, path):
+        if os.path.abspath(path) == self.path:
+            self.loop.call_soon_threadsafe(self.callback)
+
+    def on_created(self, event):
+        self._check(event.src_path)
+
+    def on_modified(self, event):
+        self._check(event.src_path)
+
+    def on_moved(self, event):
+        # Editors often save by renaming a temporary file over the original.
+        self._check(event.dest_path)
+
+
+class ReloadQueue:
+    """Coalesces module change events into batched reloads.
+
+    Events for a module are merged (the latest one decides between unload
+    and reload) until nothing has arrived for `quiet` seconds, or `max_delay`
+    seconds after the first one. Then every pending module is handled at
+    once, changed ones reloaded together in dependency order. Events that
+    arrive meanwhile make up the next batch.
+    """
+
+    def __init__(self, register, quiet=RELOAD_QUIET_PERIOD, max_delay=RELOAD_MAX_DELAY):
+        self._register = register
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.loop = None
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._task = self.loop.create_task(self._run())
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+        self._task = None
+
+    def put(self, name, deleted=False):
+        """Queue a change to module `name`. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, (name, deleted))
+
+    async def _collect(self):
+        """Wait for an event, then for things to go quiet."""
+        name, deleted = await self._queue.get()
+        pending = {name: deleted}
+        deadline = self.loop.time() + self.max_delay
+        while True:
+            timeout = min(self.quiet, deadline - self.loop.time())
+            if timeout <= 0:
+                break
+            try:
+                name, deleted = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending.pop(name, None)  # Keep the latest event last
+            pending[name] = deleted
+        return pending
+
+    async def _run(self):
+        while True:
+            pending = await self._collect()
+            try:
+                await self.apply(pending)
+            except Exception:
+                log.exception("Failed to apply changes to %s", ", ".join(pending))
+
+    async def apply(self, pending):
+        """Unload deleted modules and reload the changed ones together."""
+        for name, deleted in pending.items():
+            if deleted:
+                await self._register.unload_extension(name)
+        changed = [name for name, deleted in pending.items() if not deleted]
+        if not changed:
+            return
+        log.info("Reloading %s", ", ".join(changed))
+        unloaded, failed = await self._register.reload_extensions(changed)
+        for name, exc in failed.items():
+            log.error("Failed to reload! %s", name, exc_info=exc)
+
+
+def _source_files(spec):
+    """(path, package) for each .py file of a module, all of them for packages."""
+    if not spec.submodule_search_locations:
+        if spec.origin and spec.origin.endswith(".py"):
+            yield spec.origin, spec.parent
+        return
+    for location in spec.submodule_search_locations:
+        for dirpath, _, filenames in os.walk(location):
+            subpath = os.path.relpath(dirpath, location)
+            package = spec.name
+            if subpath != os.curdir:
+                package = ".".join([spec.name] + subpath.split(os.sep))
+            for filename in filenames:
+                if filename.endswith(".py"):
+                    yield os.path.join(dirpath, filename), package
+
+
+def _source_mtime(name):
+    """Newest mtime of a module's source, any file in it for packages."""
+    spec = importlib.util.find_spec(name)
+    if not spec or not spec.origin:
+        return None
+    if not spec.submodule_search_locations:
+        return os.stat(spec.origin).st_mtime_ns
+    return max((os.stat(path).st_mtime_ns for path, _ in _source_files(spec)), default=0)
+
+
+class ImportScanner:
+    """Finds what a module imports by parsing its source.
+
+    Sees imports anywhere in the file, including inside functions and names
+    imported from modules ("from .common.utils import dummy" gives
+    "x.common.utils" and "x.common.utils.dummy"). Parsed files are cached
+    until their mtime changes.
+    """
+
+    def __init__(self):
+        self._files = {}  # path -> (mtime_ns, imports)
+
+    def imports(self, spec):
+        """Absolute names imported by the module (or package) `spec`."""
+        imports = set()
+        for path, package in _source_files(spec):
+            imports |= self._scan(path, package)
+        return imports
+
+    def _scan(self, path, package):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read(), path)
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module
+                if node.level:
+                    try:
+                        base = importlib.util.resolve_name(
+                            "." * node.level + (node.module or ""), package)
+                    except (ImportError, ValueError):
+                        continue
+                imports.add(base)
+                imports.update(base + "." + alias.name for alias in node.names if alias.name != "*")
+        self._files[path] = (mtime, imports)
+        return imports
+
+
+class PluginManifest:
+    """Cog and command names per extension, cached on disk.
+
+    An entry is only trusted while the extension's source mtime matches the
+    one recorded with it.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dirty = False
+        try:
+            with open(filename, encoding="utf8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, name):
+        entry = self._entries.get(name)
+        if entry and entry["mtime"] == _source_mtime(name):
+            return entry
+        return None
+
+    def update(self, name, lib):
+        if self.get(name):
+            return
+        entry = core.describe_extension(lib)
+        entry["mtime"] = _source_mtime(name)
+        self._entries[name] = entry
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        with open(self.filename, 'w', encoding="utf8") as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        self.dirty = False
+
+
+class LazyExtensions:
+    """Stands in stub commands for extensions until one is invoked.
+
+    The first invocation imports the extension (and lazy extensions it
+    needs cogs from), then invokes the real command with the same message.
+    """
+
+    def __init__(self, bot, register, patterns, manifest):
+        self.bot = bot
+        self._register = register
+        self.patterns = patterns
+        self.manifest = manifest
+        self.stubs = {}  # extension name -> stub command names
+        self._providers = {}  # cog name -> lazy extension name
+        self._loading = {}
+
+    def partition(self, names):
+        """Stub out the extensions that can wait, returns the rest."""
+        entries = {name: self.manifest.get(name) for name in names}
+        if not all(entries.values()):
+            return names  # Build the manifest first.
+        lazy = {name for name, entry in entries.items()
+                if entry["lazy"] and any(fnmatch.fnmatch(name, p) for p in self.patterns)}
+        providers = {cog["name"]: name for name in lazy for cog in entries[name]["cogs"]}
+
+        # Cogs loaded now can't wait on a lazy dependency.
+        needed = [dep for name in names if name not in lazy
+                  for cog in entries[name]["cogs"] for dep in cog["depends"]]
+        while needed:
+            provider = providers.get(needed.pop())
+            if provider in lazy:
+                lazy.remove(provider)
+                needed.extend(dep for cog in entries[provider]["cogs"] for dep in cog["depends"])
+
+        for name in lazy:
+            for cog in entries[name]["cogs"]:
+                self._providers[cog["name"]] = name
+            self._add_stubs(name, entries[name]["commands"])
+        return [name for name in names if name not in lazy]
+
+    def _add_stubs(self, name, cmds):
+        added = []
+        for info in cmds:
+            async def stub(ctx):
+                await self.load(name)
+                await self.bot.invoke(await self.bot.get_context(ctx.message))
+            cmd = commands.Command(
+                stub, name=info["name"], aliases=info["aliases"], help=info["help"])
+            try:
+                self.bot.add_command(cmd)
+            except errors.CommandRegistrationError:
+                log.warning("Not stubbing %s from %s, name is taken", info["name"], name)
+                continue
+            added.append(cmd.name)
+        self.stubs[name] = added
+        log.debug("Deferred importing %s", name)
+
+    def drop_stubs(self, names):
+        for name in names:
+            for cmd in self.stubs.pop(name, ()):
+                self.bot.remove_command(cmd)
+
+    async def load(self, name):
+        if name not in self._loading:
+            self._loading[name] = asyncio.ensure_future(self._load(name))
+        await asyncio.shield(self._loading[name])
+
+    async def _load(self, name):
+        names = [name]
+        for ext in names:
+            entry = self.manifest.get(ext) or {"cogs": []}
+            for cog in entry["cogs"]:
+                for dep in cog["depends"]:
+                    provider = self._providers.get(dep)
+                    if provider in self.stubs and provider not in names:
+                        names.append(provider)
+
+        log.info("Importing %s on first use", ", ".join(names))
+        cmds = {ext: self.manifest.get(ext)["commands"] for ext in names}
+        failed = await self._register.load_extensions(names)
+        if failed:
+            for ext in names:
+                if ext not in self.bot.extensions:
+                    self._add_stubs(ext, cmds[ext])
+            del self._loading[name]
+            raise next(iter(failed.values()))
+
+
 class WatchdogExtensionLoader:
     """File watchdog based extension loader.
 
@@ -80,22 +363,51 @@ class WatchdogExtensionLoader:
     and reload the modules if they change. discord.py handles cog/etc.
     unloading, we just call unload_extension/load_extension.
     """
-    def __init__(self, bot):
+    def __init__(self, bot, lazy=(), manifest=None):
         self.bot = bot
         self._register = ExtensionDependencyRegister(bot)
+        self._reloads = ReloadQueue(self._register)
         self._watches = {}
+        self._watched_files = []
         self._observer = None
+        self._manifest = None
+        if lazy:
+            self._manifest = PluginManifest(manifest)
+            self._register.lazy = LazyExtensions(bot, self._register, lazy, self._manifest)
+
+    async def _load_extensions(self, names):
+        lazy = self._register.lazy
+        if lazy:
+            names = lazy.partition(names)
+        failed = await self._register.load_extensions(names)
+        if self._manifest:
+            for name in names:
+                if name in self.bot.extensions:
+                    self._manifest.update(name, self.bot.extensions[name])
+            self._manifest.save()
+        return failed
+
+    def watch_file(self, path, callback):
+        """Call callback (on the event loop) when path changes, once started."""
+        self._watched_files.append((path, callback))
 
     def start(self):
+        self._reloads.start()
         self._observer = observers.Observer()
         for dir_, handler in self._watches.items():
             self._observer.schedule(handler, dir_, recursive=True)
+        loop = asyncio.get_running_loop()
+        for path, callback in self._watched_files:
+            self._observer.schedule(
+                FileWatchdog(path, callback, loop),
+                os.path.dirname(os.path.abspath(path)), recursive=False)
         self._observer.start()
 
     def close(self):
         if self._observer:
             self._observer.unschedule_all()
         self._observer = None
+        self._reloads.close()
 
     async def watch_spec(self, plugin_spec):
         """Watch the plugin spec for changes.
@@ -113,6 +425,13 @@ class WatchdogExtensionLoader:
         ValueError if plugin_spec overlaps with existing spec.
         """
 
+        start = time.perf_counter()
+        try:
+            await self._watch_spec(plugin_spec)
+        finally:
+            self.bot.startup_profile.specs[plugin_spec] = time.perf_counter() - start
+
+    async def _watch_spec(self, plugin_spec):
         module_parts = plugin_spec.split('.')
 
         exts_to_load = []
@@ -149,39 +468,44 @@ class WatchdogExtensionLoader:
                 if os.path.exists(os.path.join(watched_location, modname, '__init__.py')):
                     return ".".join([plugin_spec, modname])
 
+            libs = []
             for item in os.listdir(watched_location):
                 lib = _module_name(os.path.join(watched_location, item))
                 if lib:
-                    try:
-                        await self._register.load_extension(lib)
-                    except config.InvalidConfig:
-                        log.error("Could not load %s due to invalid config!", lib)
-
-            self._watches[watched_location] = ModuleDirWatchdog(self._register, lambda e: _module_name(e.src_path))
+                    libs.append(lib)
+            failed = await self._load_extensions(libs)
+            for lib, exc in failed.items():
+                if not isinstance(exc, config.InvalidConfig):
+                    raise exc
+                log.error("Could not load %s due to invalid config!", lib)
+
+            self._watches[watched_location] = ModuleDirWatchdog(self._reloads, lambda e: _module_name(e.src_path))
         else:
             if plugin_spec in sys.modules:
                 log.warning("%s is already loaded by some outside source, we "
                             "may not be able to unload it!", plugin_spec)
 
             self._register.set_reloadable(plugin_spec)
-            mod = importlib.import_module(plugin_spec)
+            # Don't import it here, it may be lazy.
+            spec = importlib.util.find_spec(plugin_spec)
 
             # We can only schedule watchs on directories.
-            if mod.__spec__.submodule_search_locations:
-                watched_location = mod.__spec__.submodule_search_locations[0]
+            if spec.submodule_search_locations:
+                watched_location = spec.submodule_search_locations[0]
                 def module_name(event):
                     return plugin_spec
             else:
-                watched_file = mod.__spec__.origin
+                watched_file = spec.origin
                 def module_name(event):
                     if event.src_path != watched_file:
                         return
                     return plugin_spec
-                watched_location = os.path.split(mod.__spec__.origin)[0]
-            self._watches[watched_location] = ModuleDirWatchdog(self._register, module_name)
-            try:
-                await self._register.load_extension(plugin_spec)
-            except config.InvalidConfig:
+                watched_location = os.path.split(spec.origin)[0]
+            self._watches[watched_location] = ModuleDirWatchdog(self._reloads, module_name)
+            failed = await self._load_extensions([plugin_spec])
+            if plugin_spec in failed:
+                if not isinstance(failed[plugin_spec], config.InvalidConfig):
+                    raise failed[plugin_spec]
                 log.error("Could not load %s due to invalid config!", plugin_spec)
 
 
@@ -204,32 +528,55 @@ class ExtensionDependencyRegister:
         self.bot = bot
         self._deps = collections.defaultdict(set)
         self._reloadable = []
+        self._imports = ImportScanner()
+        self.lazy = None
 
     def set_reloadable(self, base):
         """Mark a base module and it's submodules as reloadable."""
         self._reloadable.append(base)
 
     async def load_extension(self, name):
-        """Load an extension and track it's dependencies.
+        """Load an extension and track it's dependencies."""
+        failed = await self.load_extensions([name])
+        if name in failed:
+            raise failed[name]
 
-        Extension "curious" imports "common", so add a dependency.
-        self._deps["common"].append("curious")
-        """
+    async def load_extensions(self, names):
+        """Load extensions together and track their dependencies.
 
-        await self.bot.load_extension(name)  # Assume all goes well...
-        lib = self.bot.extensions[name]  # Will throw if it didn't go well anyways RIP
+        Extension "curious" imports "common", so add a dependency.
+        "common" in self._deps["curious"]
 
-        for item in dir(lib):  # TODO - inspect.members
-            val = getattr(lib, item)
+        Imports are found by scanning the source, see ImportScanner.
 
-            if isinstance(val, types.ModuleType):
-                for r in self._reloadable:
-                    if _is_submodule(r, val.__spec__.name):
-                        log.info("module %s imports %s which is probably reloadable", name, val)
-                        self._deps[name].add(val.__spec__.name)
-                        break
-            elif hasattr(val, "__module__"):  # TODO
-                pass
+        Returns a dict of extension name to exception for those that failed.
+        """
+        if self.lazy:
+            self.lazy.drop_stubs(names)
+        failed = await self.bot.load_extensions(names)
+
+        for name in names:
+            lib = self.bot.extensions.get(name)
+            if lib:
+                self._track_imports(name, lib)
+        return failed
+
+    def _track_imports(self, name, lib):
+        """Replace name's dependencies with the reloadable modules it imports."""
+        try:
+            imports = self._imports.imports(lib.__spec__)
+        except (OSError, SyntaxError):
+            log.exception("Couldn't scan %s for imports", name)
+            return
+        deps = set()
+        for imported in imports:
+            if _is_submodule(name, imported):
+                continue
+            if any(_is_submodule(r, imported) for r in self._reloadable):
+                deps.add(imported)
+        if deps:
+            log.debug("module %s imports reloadable %s", name, ", ".join(sorted(deps)))
+        self._deps[name] = deps
 
     async def unload_extension(self, name, unload_dependants=False, unloaded_extensions=None):
         """Unload an extension. Do not unload dependants.
@@ -241,7 +588,8 @@ class ExtensionDependencyRegister:
         """
         log.info("Preparing to unload %s", name)
 
-        unloaded_extensions = unloaded_extensions or []
+        if unloaded_extensions is None:
+            unloaded_extensions = []
         unloaded_extensions.append(name)
 
         if unload_dependants:
@@ -271,9 +619,49 @@ class ExtensionDependencyRegister:
 
         Unloading extension "common", check _deps and unload it's dependants
         first. (recursively etc.)
-
         """
-        unloaded_deps = await self.unload_extension(name, unload_dependants=True)
+        unloaded_deps, failed = await self.reload_extensions([name])
         for unloaded_dep in unloaded_deps:
-            await self.load_extension(unloaded_dep)
+            if unloaded_dep in failed:
+                raise failed[unloaded_dep]
         return unloaded_deps
+
+    async def reload_extensions(self, names):
+        """Reload several extensions and their dependants as one batch.
+
+        Everything affected is unloaded once, then loaded together with
+        imported modules before the extensions that import them. Cogs that
+        implement the state handoff (see DangoBotBase.state_handoff) keep
+        their state across the reload.
+
+        Returns the reloaded extensions in load order, and a dict of
+        extension name to exception for those that failed to load.
+        """
+        with self.bot.state_handoff():
+            unloaded = []
+            for name in names:
+                if name not in unloaded:
+                    await self.unload_extension(
+                        name, unload_dependants=True, unloaded_extensions=unloaded)
+            unloaded = self._dependency_order(unloaded)
+            failed = await self.load_extensions(unloaded)
+        return unloaded, failed
+
+    def _dependency_order(self, names):
+        """Sort names so the modules an extension imports come before it."""
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in visiting:
+                return
+            visiting.add(name)
+            for dep in self._deps.get(name, ()):
+                for other in names:
+                    if _is_submodule(other, dep):
+                        visit(other)
+            ordered.append(name)
+
+        for name in names:
+            visit(name)
+        return ordered
@@ -0,0 +1,133 @@
+"""Records raw gateway traffic for replaying with benchmarks.replay.
+
+Traces are gzipped text, one received message per line:
+
+    <seconds since recording started>\t<raw gateway json>
+
+Recording needs the bot's debug events, which this cog turns on; they only
+take effect on the next gateway connect, so load it before the bot starts
+to capture READY and GUILD_CREATE.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import gzip
+import logging
+import os
+import time
+
+from dango import dcog, Cog
+from discord.ext.commands import command
+
+from dango.plugins.common import checks
+from dango.plugins.common import utils
+
+log = logging.getLogger(__name__)
+
+
+def read_trace(filename):
+    """Yields (offset, raw) for every message in a trace."""
+    with gzip.open(filename, 'rt', encoding="utf8") as f:
+        for line in f:
+            offset, _, raw = line.rstrip("\n").partition("\t")
+            yield float(offset), raw
+
+
+class TraceWriter:
+    """Buffers lines, compresses and writes them off the event loop."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.start = time.monotonic()
+        self.events = 0
+        self._buffer = []
+        self._stream = gzip.open(filename, 'wt', encoding="utf8")
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def emit(self, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf8')
+        self._buffer.append("%.6f\t%s\n" % (time.monotonic() - self.start, raw))
+        self.events += 1
+
+    def _write(self, lines):
+        self._stream.writelines(lines)
+        self._stream.flush()
+
+    async def flush(self):
+        lines, self._buffer = self._buffer, []
+        if lines:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write, lines)
+
+    async def close(self):
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._stream.close)
+        self._executor.shutdown()
+
+
+@dcog(pass_bot=True)
+class GatewayTrace(Cog):
+    """Captures on_socket_raw_receive to a trace file."""
+
+    def __init__(self, bot, config):
+        self.bot = bot
+        self.trace_dir = config.register("trace_dir", default="traces").value
+        self.record = config.register("record", default=False)
+        self.writer = None
+        self.flush_task = None
+        # Read when the gateway connects.
+        bot._enable_debug_events = True
+
+    async def cog_load(self):
+        if self.record():
+            self.start_recording()
+
+    async def cog_unload(self):
+        await self.stop_recording()
+
+    def start_recording(self):
+        if not os.path.exists(self.trace_dir):
+            os.mkdir(self.trace_dir)
+        filename = os.path.join(self.trace_dir, "gateway.{:%Y%m%d%H%M%S}.trace.gz".format(
+            datetime.datetime.utcnow()))
+        self.writer = TraceWriter(filename)
+        self.flush_task = utils.create_task(self.flush_loop(self.writer))
+        log.info("Recording gateway trace to %s", filename)
+
+    async def stop_recording(self):
+        writer, self.writer = self.writer, None
+        if not writer:
+            return None
+        self.flush_task.cancel()
+        await asyncio.gather(self.flush_task, return_exceptions=True)
+        await writer.close()
+        log.info("Recorded %d messages to %s", writer.events, writer.filename)
+        return writer
+
+    async def flush_loop(self, writer):
+        while True:
+            try:
+                await writer.flush()
+            except Exception:
+                log.exception("Exception writing gateway trace!")
+            await asyncio.sleep(1)
+
+    @Cog.listener()
+    async def on_socket_raw_receive(self, msg):
+        if self.writer:
+            self.writer.emit(msg)
+
+    @command()
+    @checks.is_owner()
+    async def gateway_trace(self, ctx, enable: bool):
+        """Start or stop recording gateway traffic."""
+        if enable and not self.writer:
+            self.start_recording()
+            await ctx.send("Recording to %s" % self.writer.filename)
+        elif not enable and self.writer:
+            writer = await self.stop_recording()
+            await ctx.send("Recorded %d messages to %s" % (writer.events, writer.filename))
+        else:
+            await ctx.send("Already %s." % ("recording" if self.writer else "stopped"))
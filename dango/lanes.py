@@ -0,0 +1,68 @@
+"""Bounded lanes for event listeners.
+
+discord.py starts a task per listener per event. Listeners declared with
+@Cog.listener(lane=...) instead go through a ListenerLane, which runs at
+most max_concurrency of them at a time and queues the rest, so a burst of
+events doesn't turn into a pile of tasks all waiting on the same slow
+backend.
+"""
+import asyncio
+import collections
+import functools
+import logging
+
+log = logging.getLogger(__name__)
+
+# Events waiting in a lane before new ones are dropped.
+LANE_MAX_QUEUE = 1000
+
+
+class ListenerLane:
+    """Runs listener tasks, at most max_concurrency at once.
+
+    Up to max_queue more wait their turn in order; past that new events are
+    dropped and counted.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue=LANE_MAX_QUEUE):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.dropped = 0
+        self._queue = collections.deque()
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def submit(self, start):
+        """Run start() (which creates the listener task) when there's room.
+
+        Returns the task, a future done when a queued listener finishes, or
+        None if the event was dropped.
+        """
+        if self.running < self.max_concurrency:
+            return self._start(start)
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                log.warning("Listener lane %s is full, %d events dropped so far",
+                            self.name, self.dropped)
+            return None
+        done = asyncio.get_running_loop().create_future()
+        self._queue.append((start, done))
+        return done
+
+    def _start(self, start, done=None):
+        self.running += 1
+        task = start()
+        task.add_done_callback(functools.partial(self._finished, done))
+        return task
+
+    def _finished(self, done, task):
+        self.running -= 1
+        if done is not None and not done.done():
+            done.set_result(None)
+        while self._queue and self.running < self.max_concurrency:
+            self._start(*self._queue.popleft())
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import logging
 
 from dango import dcog, Cog
 import discord
@@ -7,8 +9,11 @@ from lru import LRU
 
 from .common import checks
 from .common import converters
+from .common import serialization
 from .common import utils
 
+log = logging.getLogger(__name__)
+
 
 def _redis_key(item_type, item_id):
     return "spoo:attribute:%s:%s" % (item_type, item_id)
@@ -22,11 +27,26 @@ class AttributeStore(Cog):
         - in memory LRU
         - redis
         - psql
+
+    Redis values are encoded with `codec` (see common.serialization), psql
+    stores plain json in a jsonb column.
+
+    Reads are recorded in `last_access` in batches. If `warmup_count` is set,
+    that many of the most recently used rows are streamed into redis and the
+    LRU on load, so a restart doesn't send every first lookup to psql.
+
+    `find` looks up ids by attribute value using the GIN index on data. Keys
+    registered with `register_reverse_key` have their results cached, and the
+    cache is invalidated when this process updates that key.
     """
 
     def __init__(self, config, database, redis):
         self.database = database
         self.redis = redis
+        self.codec = config.register("codec", default="msgpack")
+        self._codec = serialization.get_codec(self.codec())
+        self.warmup_count = config.register("warmup_count", default=0)
+        self.warmup_batch_size = config.register("warmup_batch_size", default=1000)
 
         self._mapping = utils.TypeMap()
 
@@ -38,11 +58,135 @@ class AttributeStore(Cog):
         self.register_mapping(discord.Guild, 'server')
         self.register_mapping(discord.TextChannel, 'channel')
 
+        self.batch_access_updates = set()
+        self.batch_access_task = None
+
+        self._reverse_keys = set()
+        self._reverse_lru = LRU(1024)
+
+    async def cog_load(self):
+        # A reload that handed over the LRU is already warm.
+        if self.warmup_count() and not len(self._lru):
+            try:
+                await self.warmup(self.warmup_count(), self.warmup_batch_size())
+            except Exception:
+                log.exception("Failed to warm up attribute caches!")
+        self.batch_access_task = utils.create_task(self.batch_access())
+
+    async def cog_unload(self):
+        if self.batch_access_task:
+            self.batch_access_task.cancel()
+            await self.batch_access_task
+
+    def __dango_export_state__(self):
+        state = {
+            "lru": self._lru.items(),
+            "reverse_lru": self._reverse_lru.items(),
+            "access": self.batch_access_updates,
+        }
+        self.batch_access_updates = set()
+        return state
+
+    def __dango_import_state__(self, state):
+        utils.restore_lru(self._lru, state["lru"])
+        utils.restore_lru(self._reverse_lru, state["reverse_lru"])
+        self.batch_access_updates |= state["access"]
+
+    async def batch_access(self):
+        try:
+            while True:
+                try:
+                    await self.do_batch_access_update()
+                except Exception:
+                    log.exception("Exception during attribute access update task!")
+                await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            log.info("batch_access task canceled...")
+            await self.do_batch_access_update()
+
+    async def do_batch_access_update(self):
+        """Push recorded reads to psql's last_access."""
+        updates = self.batch_access_updates
+        self.batch_access_updates = set()
+        if not updates:
+            return
+
+        item_types, item_ids = zip(*updates)
+        async with self.database.acquire() as conn:
+            await conn.execute(
+                "UPDATE attributes SET last_access = now() "
+                "FROM unnest($1::varchar[], $2::varchar[]) AS accessed (type, id) "
+                "WHERE attributes.type = accessed.type AND attributes.id = accessed.id",
+                item_types, item_ids)
+
+    async def warmup(self, count, batch_size):
+        """Stream the `count` most recently used rows into redis and the LRU."""
+        lru_rows = []
+        lru_size = self._lru.get_size()
+        loaded = 0
+
+        async def flush(batch):
+            async with self.redis.acquire() as conn:
+                await conn.mset({
+                    _redis_key(item_type, item_id): serialization.encode(value, self._codec)
+                    for item_type, item_id, value in batch})
+
+        async with self.database.acquire(readonly=True) as conn:
+            async with conn.transaction():
+                batch = []
+                async for row in conn.cursor(
+                        "SELECT type, id, data FROM attributes "
+                        "ORDER BY last_access DESC NULLS LAST LIMIT $1",
+                        count, prefetch=batch_size):
+                    if row['data'] is None:
+                        continue
+                    entry = (row['type'], int(row['id']), json.loads(row['data']))
+                    batch.append(entry)
+                    if row['type'] in self._lru_types and len(lru_rows) < lru_size:
+                        lru_rows.append(entry)
+                    if len(batch) >= batch_size:
+                        await flush(batch)
+                        loaded += len(batch)
+                        batch = []
+                if batch:
+                    await flush(batch)
+                    loaded += len(batch)
+
+        # Least recent first, so the most recent rows are the last evicted.
+        for item_type, item_id, value in reversed(lru_rows):
+            await self._put_lru(item_type, item_id, value)
+        log.info("Warmed up %d attribute documents (%d in LRU)", loaded, len(lru_rows))
+
     def register_mapping(self, item_type, name, lru=True):
         self._mapping.put(item_type, name)
         if lru:
             self._lru_types.add(name)
 
+    def register_reverse_key(self, item_type, key):
+        """Cache `find` results for key.
+
+        Only safe if this process is the only writer of key.
+        """
+        self._reverse_keys.add((self._type_name(item_type), key))
+
+    def _type_name(self, item_type):
+        if isinstance(item_type, type):
+            return self._mapping.lookup(item_type)
+        return item_type
+
+    def _reverse_cache_key(self, item_type, key, value):
+        return (item_type, key, json.dumps(value, sort_keys=True))
+
+    def _invalidate_reverse(self, item_type, old, new):
+        for key, value in new.items():
+            if (item_type, key) not in self._reverse_keys:
+                continue
+            for stale in (old.get(key), value):
+                try:
+                    del self._reverse_lru[self._reverse_cache_key(item_type, key, stale)]
+                except KeyError:
+                    pass
+
     async def _get_lru(self, item_type, item_id):
         if item_type not in self._lru_types:
             return
@@ -56,14 +200,16 @@ class AttributeStore(Cog):
         async with self.redis.acquire() as conn:
             res = await conn.get(_redis_key(item_type, item_id))
             if res:
-                return json.loads(res.decode("utf8"))
+                return serialization.decode(res)
 
     async def _put_redis(self, item_type, item_id, value):
         async with self.redis.acquire() as conn:
-            await conn.set(_redis_key(item_type, item_id), json.dumps(value))
+            await conn.set(
+                _redis_key(item_type, item_id),
+                serialization.encode(value, self._codec))
 
     async def _get_db(self, item_type, item_id):
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             res = await conn.fetchrow(
                 "SELECT * FROM attributes "
                 "WHERE id = $1 AND type = $2", str(item_id), item_type)
@@ -79,6 +225,7 @@ class AttributeStore(Cog):
                 str(item_id), item_type, json.dumps(value))
 
     async def _get(self, item_type, item_id):
+        self.batch_access_updates.add((item_type, str(item_id)))
         res = await self._get_lru(item_type, item_id)
         if res:
             return res
@@ -102,9 +249,39 @@ class AttributeStore(Cog):
 
     async def _update(self, item_type, item_id, **vals):
         cur = await self._get(item_type, item_id)
+        if self._reverse_keys:
+            self._invalidate_reverse(item_type, cur, vals)
         cur.update(vals)
         await self._put(item_type, item_id, cur)
 
+    async def _find_db(self, item_type, key, value, batch_size=1000):
+        async with self.database.acquire(readonly=True) as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(
+                        "SELECT id FROM attributes "
+                        "WHERE type = $1 AND data @> $2::jsonb",
+                        item_type, json.dumps({key: value}), prefetch=batch_size):
+                    yield int(row['id'])
+
+    async def find(self, item_type, key, value):
+        """Yield ids of items of item_type whose attribute key equals value.
+
+        item_type is a mapped class (e.g. discord.User) or its mapping name.
+        """
+        item_type = self._type_name(item_type)
+        if (item_type, key) not in self._reverse_keys:
+            async for item_id in self._find_db(item_type, key, value):
+                yield item_id
+            return
+
+        cache_key = self._reverse_cache_key(item_type, key, value)
+        cached = self._reverse_lru.get(cache_key)
+        if cached is None:
+            cached = [item_id async for item_id in self._find_db(item_type, key, value)]
+            self._reverse_lru[cache_key] = cached
+        for item_id in cached:
+            yield item_id
+
     def get(self, item):
         return self._get(self._mapping.lookup(type(item)), item.id)
 
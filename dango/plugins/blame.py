@@ -12,7 +12,7 @@ class Blame(Cog):
     def __init__(self, config, database):
         self.database = database
 
-    @Cog.listener()
+    @Cog.listener(lane="database", max_concurrency=4)
     async def on_dango_message_sent(self, msg, ctx):
         async with self.database.acquire() as conn:
             server_id = ctx.guild and ctx.guild.id
@@ -30,7 +30,7 @@ class Blame(Cog):
         must enable developer mode in order to get message ids.
         See Discord's documentation here: https://waa.ai/j06h
         """
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             row = await conn.fetchrow(
                 "SELECT blame.id, blame.message_id, blame.author_id, "
                 "blame.channel_id, blame.server_id "
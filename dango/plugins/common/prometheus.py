@@ -0,0 +1,29 @@
+"""Helpers for declaring prometheus metrics from cogs.
+
+Metrics live in the global registry, so they survive cog reloads. Declaring
+one that already exists returns the existing collector instead of raising.
+PrometheusMetrics serves everything in the registry.
+"""
+import prometheus_client
+
+
+def get_metric(name):
+    try:
+        return prometheus_client.REGISTRY._names_to_collectors[name]
+    except KeyError:
+        for key, value in prometheus_client.REGISTRY._collector_to_names.items():
+            for val in value:
+                if val.startswith(name):
+                    return key
+    raise KeyError(name)
+
+
+def declare_metric(name, type, *args, namespace="dango", function=None, **kwargs):
+    try:
+        metric = type(name, *args, namespace=namespace, **kwargs)
+    except ValueError:  # Already exists
+        metric = get_metric(namespace + "_" + name)
+
+    if function:
+        metric.set_function(function)
+    return metric
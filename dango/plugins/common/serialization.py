@@ -0,0 +1,72 @@
+"""Codecs for documents we stash in redis.
+
+Encoded values are prefixed with a single version byte naming the codec that
+wrote them, so codecs can be swapped without flushing redis. Values written
+before versioning existed are plain json text, which always starts with a
+printable character, so anything without a known version byte is decoded as
+json.
+"""
+import json
+
+import msgpack
+
+
+class Codec:
+    """Base codec. Subclasses set `version` and implement the payload format."""
+    version = None
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    version = 1
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf8'))
+
+
+class MsgpackCodec(Codec):
+    version = 2
+    name = "msgpack"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+_CODECS_BY_VERSION = {codec.version: codec for codec in CODECS.values()}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown codec %r, expected one of %s" % (
+            name, ", ".join(sorted(CODECS))))
+
+
+def encode(obj, codec):
+    """Encode obj with codec, prefixed by the codec's version byte."""
+    return bytes((codec.version,)) + codec.dumps(obj)
+
+
+def decode(data):
+    """Decode a value written by `encode`, or a legacy unversioned json value."""
+    if isinstance(data, str):
+        data = data.encode('utf8')
+    codec = _CODECS_BY_VERSION.get(data[0]) if data else None
+    if codec is None:
+        return json.loads(data.decode('utf8'))
+    return codec.loads(data[1:])
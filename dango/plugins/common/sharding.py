@@ -0,0 +1,123 @@
+"""Consistent hashing of redis keys across several nodes."""
+import asyncio
+import bisect
+import zlib
+
+
+def _hash(key):
+    if isinstance(key, str):
+        key = key.encode('utf8')
+    return zlib.crc32(key)
+
+
+class HashRing:
+    """Maps keys to node indexes.
+
+    Each node gets `replicas` points on the ring, named after the node, so
+    adding or removing a node only moves the keys next to its points.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash("%s-%d" % (node, replica)), idx)
+            for idx, node in enumerate(self.nodes)
+            for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._indexes = [idx for _, idx in points]
+
+    def index(self, key):
+        pos = bisect.bisect(self._hashes, _hash(key))
+        if pos == len(self._hashes):
+            pos = 0
+        return self._indexes[pos]
+
+
+class ShardedClient:
+    """Looks like a single redis client, routes each key to its node.
+
+    Single key commands are routed on their first argument. mget, mset,
+    delete and exists are split per node and run concurrently. scan walks the
+    nodes one after another, packing the node index into the cursor.
+    Commands without a key (flushdb, config_set, ...) can be sent to every
+    node with `broadcast`.
+    """
+
+    def __init__(self, clients, ring):
+        self._clients = clients
+        self._ring = ring
+
+    def __getattr__(self, name):
+        def routed(key, *args, **kwargs):
+            return getattr(self.client_for(key), name)(key, *args, **kwargs)
+        return routed
+
+    async def __aenter__(self):
+        for client in self._clients:
+            await client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        for client in self._clients:
+            await client.__aexit__(*args, **kwargs)
+
+    def client_for(self, key):
+        return self._clients[self._ring.index(key)]
+
+    def _group(self, keys):
+        groups = {}
+        for pos, key in enumerate(keys):
+            groups.setdefault(self._ring.index(key), []).append((pos, key))
+        return groups
+
+    async def broadcast(self, name, *args, **kwargs):
+        return await asyncio.gather(*(
+            getattr(client, name)(*args, **kwargs) for client in self._clients))
+
+    async def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        keys.extend(args)
+        groups = self._group(keys)
+        results = [None] * len(keys)
+        values = await asyncio.gather(*(
+            self._clients[idx].mget([key for _, key in items])
+            for idx, items in groups.items()))
+        for items, node_values in zip(groups.values(), values):
+            for (pos, _), value in zip(items, node_values):
+                results[pos] = value
+        return results
+
+    async def mset(self, mapping):
+        groups = self._group(list(mapping))
+        res = await asyncio.gather(*(
+            self._clients[idx].mset({key: mapping[key] for _, key in items})
+            for idx, items in groups.items()))
+        return all(res)
+
+    async def _count(self, name, keys):
+        groups = self._group(keys)
+        return sum(await asyncio.gather(*(
+            getattr(self._clients[idx], name)(*(key for _, key in items))
+            for idx, items in groups.items())))
+
+    def delete(self, *names):
+        return self._count("delete", names)
+
+    def exists(self, *names):
+        return self._count("exists", names)
+
+    async def flushdb(self, *args, **kwargs):
+        return all(await self.broadcast("flushdb", *args, **kwargs))
+
+    async def scan(self, cursor=0, match=None, count=None, **kwargs):
+        cursor = int(cursor)
+        node_count = len(self._clients)
+        idx, node_cursor = cursor % node_count, cursor // node_count
+        node_cursor, keys = await self._clients[idx].scan(
+            node_cursor, match=match, count=count, **kwargs)
+        node_cursor = int(node_cursor)
+        if node_cursor:
+            return node_cursor * node_count + idx, keys
+        if idx + 1 < node_count:
+            return idx + 1, keys  # Start of the next node
+        return 0, keys
@@ -206,6 +206,12 @@ def create_task(thing):
     return task
 
 
+def restore_lru(lru, items):
+    """Fill an LRU from another LRU's items(), keeping their recency order."""
+    for key, value in reversed(items):
+        lru[key] = value
+
+
 def value_format(k, v, col_len):
     v = str(v).split("\n")
 
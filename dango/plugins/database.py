@@ -1,15 +1,35 @@
 import asyncio
+import collections
 import logging
+import re
+import sys
+import time
 
 import asyncpg
 from dango import dcog, Cog
+import prometheus_client
 
-from .common.utils import AsyncContextWrapper
+from .common import prometheus
 from .common import utils
 
 
 log = logging.getLogger(__name__)
 
+LATENCY_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|\b\d+\b")
+_VALUES_LISTS = re.compile(r"(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+")
+_FINGERPRINT_CACHE_MAX_LEN = 1024
+
+# Seconds since the last replayed transaction, 0 on a primary.
+REPLICA_LAG_QUERY = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "ELSE 0 END::float8")
+_fingerprint_cache = {}
+
 
 def multi_insert_str(lst):
     count = len(lst)
@@ -19,20 +39,390 @@ def multi_insert_str(lst):
     return ", ".join(indiv)
 
 
+def _fingerprint(query):
+    query = _WHITESPACE.sub(" ", query.strip())
+    query = _LITERALS.sub("?", query)
+    return _VALUES_LISTS.sub(r"\1, ...", query)
+
+
+def fingerprint(query):
+    """Normalize a statement for use as a metric label.
+
+    Literals and placeholders become ?, and multi_insert_str value lists
+    collapse to a single tuple, so batches of any size share a fingerprint.
+    """
+    if len(query) > _FINGERPRINT_CACHE_MAX_LEN:
+        # Big multi-inserts, don't keep these around.
+        return _fingerprint(query)
+    try:
+        return _fingerprint_cache[query]
+    except KeyError:
+        if len(_fingerprint_cache) > 4096:
+            _fingerprint_cache.clear()
+        res = _fingerprint_cache[query] = _fingerprint(query)
+        return res
+
+
+def _status_rows(status):
+    """Rows affected from a command status like "INSERT 0 5"."""
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (AttributeError, ValueError):
+        return 0
+
+
+class InstrumentedConnection:
+    """Proxy for an asyncpg connection that records per-statement metrics.
+
+    Anything not wrapped here (transaction, cursor, ...) is passed through.
+    """
+
+    def __init__(self, conn, database, caller):
+        self._conn = conn
+        self._database = database
+        self._caller = caller
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, query, coro, count_rows):
+        start = time.perf_counter()
+        res = await coro
+        self._database.observe_query(
+            query, time.perf_counter() - start, count_rows(res), self._caller)
+        return res
+
+    def execute(self, query, *args, **kwargs):
+        return self._timed(
+            query, self._conn.execute(query, *args, **kwargs), _status_rows)
+
+    def executemany(self, command, args, **kwargs):
+        return self._timed(
+            command, self._conn.executemany(command, args, **kwargs), lambda _: len(args))
+
+    def fetch(self, query, *args, **kwargs):
+        return self._timed(
+            query, self._conn.fetch(query, *args, **kwargs), len)
+
+    def fetchrow(self, query, *args, **kwargs):
+        return self._timed(
+            query, self._conn.fetchrow(query, *args, **kwargs), lambda r: int(r is not None))
+
+    def fetchval(self, query, *args, **kwargs):
+        return self._timed(
+            query, self._conn.fetchval(query, *args, **kwargs), lambda r: int(r is not None))
+
+    def copy_records_to_table(self, table_name, *, records, **kwargs):
+        return self._timed(
+            "COPY %s" % table_name,
+            self._conn.copy_records_to_table(table_name, records=records, **kwargs),
+            _status_rows)
+
+
+class AdaptiveLimit:
+    """Caps concurrent acquires somewhere between minsize and maxsize.
+
+    Every `window` acquires, looks at the p95 acquire wait. Above
+    `target_wait` the cap grows by one, under a tenth of it (with the cap
+    never reached) it shrinks by one. The pool closes connections that go
+    unused above its minimum, so a lower cap eventually means fewer
+    connections.
+    """
+
+    def __init__(self, minsize, maxsize, target_wait, window=100):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.limit = minsize
+        self.in_use = 0
+        self.target_wait = target_wait
+        self._window = window
+        self._waits = []
+        self._waiters = collections.deque()
+        self._peak = 0
+
+    @property
+    def waiting(self):
+        return sum(1 for fut in self._waiters if not fut.done())
+
+    async def acquire(self):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()  # Handed a slot, but we don't want it anymore.
+                raise
+        self._peak = max(self._peak, self.in_use)
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_use += 1
+                fut.set_result(None)
+
+    def record_wait(self, seconds):
+        self._waits.append(seconds)
+        if len(self._waits) < self._window:
+            return
+        waits = sorted(self._waits)
+        p95 = waits[int(len(waits) * 0.95)]
+        self._waits = []
+
+        if p95 > self.target_wait and self.limit < self.maxsize:
+            self.limit += 1
+            log.info("p95 pool wait %.4fs, growing pool limit to %d", p95, self.limit)
+            self._wake()
+        elif (p95 < self.target_wait / 10 and self._peak < self.limit
+              and self.limit > self.minsize):
+            self.limit -= 1
+            log.info("p95 pool wait %.4fs, shrinking pool limit to %d", p95, self.limit)
+        self._peak = self.in_use
+
+
+class Replica:
+    """A read replica's pool and health."""
+
+    def __init__(self, index, dsn):
+        self.index = index
+        self.dsn = dsn
+        self.engine = None
+        self.lag = None
+        self.healthy = False
+
+    def __repr__(self):
+        return "<Replica index=%d healthy=%s lag=%s>" % (self.index, self.healthy, self.lag)
+
+
+class _InstrumentedAcquire:
+
+    def __init__(self, database, caller, readonly=False):
+        self._database = database
+        self._caller = caller
+        self._readonly = readonly
+
+    async def __aenter__(self):
+        database = self._database
+        replica = database._pick_replica() if self._readonly else None
+        if replica:
+            try:
+                conn = await self._enter(replica.engine, None)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError,
+                    asyncpg.InterfaceError):
+                log.warning("Replica %d failed, falling back to primary",
+                            replica.index, exc_info=True)
+                replica.healthy = False
+            else:
+                database.readonly_acquires.labels(target="replica").inc()
+                return conn
+        if self._readonly:
+            database.readonly_acquires.labels(target="primary").inc()
+        return await self._enter(database._engine, database._limit)
+
+    async def _enter(self, engine, limit):
+        database = self._database
+        start = time.perf_counter()
+        database.waiting += 1
+        try:
+            if limit:
+                await limit.acquire()
+            try:
+                self._ctx = engine.acquire()
+                conn = await self._ctx.__aenter__()
+            except BaseException:
+                if limit:
+                    limit.release()
+                raise
+        finally:
+            database.waiting -= 1
+        self._limit = limit
+        self._acquired = time.perf_counter()
+        wait = self._acquired - start
+        database.pool_wait.labels(caller=self._caller).observe(wait)
+        if limit:
+            limit.record_wait(wait)
+        return InstrumentedConnection(conn, database, self._caller)
+
+    async def __aexit__(self, *args, **kwargs):
+        self._database.connection_hold.labels(caller=self._caller).observe(
+            time.perf_counter() - self._acquired)
+        try:
+            return await self._ctx.__aexit__(*args, **kwargs)
+        finally:
+            if self._limit:
+                self._limit.release()
+
+
 @dcog()
 class Database(Cog):
+    """asyncpg pool.
+
+    Connections handed out by `acquire` record statement latency and rows
+    per query fingerprint, and pool wait/hold time per calling module. Slower
+    statements than `slow_query_threshold` seconds are logged.
+
+    The pool holds between `minsize` and `maxsize` connections. With
+    `adaptive` set, concurrent acquires are further capped by an
+    AdaptiveLimit that tracks `adaptive_target_wait`; edits to those three
+    in the config file apply to the limit without a reload. `command_timeout`
+    (seconds, 0 for none) applies to every statement.
+
+    `acquire(readonly=True)` round-robins over `replica_dsns`, skipping
+    replicas that are down or more than `max_replica_lag` seconds behind, and
+    falls back to the primary if none are usable.
+    """
 
     def __init__(self, config):
         self.dsn = config.register("dsn")
+        self.slow_query_threshold = config.register("slow_query_threshold", default=0.5)
+        self.minsize = config.register("minsize", default=10)
+        self.maxsize = config.register("maxsize", default=10)
+        self.command_timeout = config.register("command_timeout", default=0)
+        self.adaptive = config.register("adaptive", default=False)
+        self.adaptive_target_wait = config.register("adaptive_target_wait", default=0.005)
+        self.replica_dsns = config.register("replica_dsns", default=[])
+        self.max_replica_lag = config.register("max_replica_lag", default=5)
+        for entry in (self.minsize, self.maxsize, self.adaptive_target_wait):
+            entry.on_change(self._resize_limit)
+
+        self._engine = None
+        self._limit = None
+        self.waiting = 0
+        self._replicas = [Replica(idx, dsn) for idx, dsn in enumerate(self.replica_dsns())]
+        self._next_replica = 0
+        self._replica_task = None
+
+        self.query_timing = prometheus.declare_metric(
+            "db_query_seconds", prometheus_client.Histogram,
+            "Database statement latency", ["query"], buckets=LATENCY_BUCKETS)
+        self.query_rows = prometheus.declare_metric(
+            "db_query_rows", prometheus_client.Counter,
+            "Database rows returned or affected", ["query"])
+        self.pool_wait = prometheus.declare_metric(
+            "db_pool_wait_seconds", prometheus_client.Histogram,
+            "Time spent waiting for a pool connection", ["caller"],
+            buckets=LATENCY_BUCKETS)
+        self.connection_hold = prometheus.declare_metric(
+            "db_connection_hold_seconds", prometheus_client.Histogram,
+            "Time a pool connection is held", ["caller"], buckets=LATENCY_BUCKETS)
+        self.pool_connections = prometheus.declare_metric(
+            "db_pool_connections", prometheus_client.Gauge,
+            "Database pool connections", ["state"])
+        self.pool_connections.labels(state="in_use").set_function(
+            lambda: self._engine.get_size() - self._engine.get_idle_size() if self._engine else 0)
+        self.pool_connections.labels(state="idle").set_function(
+            lambda: self._engine.get_idle_size() if self._engine else 0)
+        self.pool_waiters = prometheus.declare_metric(
+            "db_pool_waiters", prometheus_client.Gauge,
+            "Acquires waiting for a database connection",
+            function=lambda: self.waiting)
+        self.pool_limit = prometheus.declare_metric(
+            "db_pool_limit", prometheus_client.Gauge,
+            "Maximum concurrent database connections",
+            function=lambda: self._limit.limit if self._limit else self.maxsize())
+        self.replica_lag = prometheus.declare_metric(
+            "db_replica_lag_seconds", prometheus_client.Gauge,
+            "Replication lag of read replicas", ["replica"])
+        self.readonly_acquires = prometheus.declare_metric(
+            "db_readonly_acquires", prometheus_client.Counter,
+            "Read-only acquires by where they were served", ["target"])
 
     async def cog_load(self):
-        self._engine = await asyncpg.create_pool(self.dsn())
+        if self.adaptive():
+            self._limit = AdaptiveLimit(
+                self.minsize(), self.maxsize(), self.adaptive_target_wait())
+        self._engine = await asyncpg.create_pool(
+            self.dsn(), min_size=self.minsize(), max_size=self.maxsize(),
+            command_timeout=self.command_timeout() or None)
+        if self._replicas:
+            await self.check_replicas()
+            self._replica_task = utils.create_task(self.monitor_replicas())
 
     async def cog_unload(self):
+        if self._replica_task:
+            self._replica_task.cancel()
+        for replica in self._replicas:
+            if replica.engine:
+                await replica.engine.close()
         await self._engine.close()
 
-    async def _acquire(self):
-        return self._engine.acquire()
+    def _resize_limit(self, _):
+        """Apply pool size edits to the adaptive limit.
+
+        The pool itself keeps the size it was created with, so the limit
+        can't grow past that until the cog is reloaded.
+        """
+        if not self._limit:
+            return
+        maxsize = self.maxsize()
+        if self._engine and maxsize > self._engine.get_max_size():
+            log.warning("Pool maxsize %d needs a reload to go above %d",
+                        maxsize, self._engine.get_max_size())
+            maxsize = self._engine.get_max_size()
+        self._limit.minsize = min(self.minsize(), maxsize)
+        self._limit.maxsize = maxsize
+        self._limit.limit = max(self._limit.minsize, min(self._limit.limit, maxsize))
+        self._limit.target_wait = self.adaptive_target_wait()
+        self._limit._wake()
+
+    async def monitor_replicas(self):
+        while True:
+            await asyncio.sleep(5)
+            try:
+                await self.check_replicas()
+            except Exception:
+                log.exception("Exception while checking replicas!")
+
+    async def check_replicas(self):
+        """Refresh lag and health of each replica, connecting if needed."""
+        for replica in self._replicas:
+            try:
+                if replica.engine is None:
+                    replica.engine = await asyncpg.create_pool(
+                        replica.dsn, min_size=1, max_size=self.maxsize(),
+                        command_timeout=self.command_timeout() or None)
+                async with replica.engine.acquire() as conn:
+                    replica.lag = await conn.fetchval(REPLICA_LAG_QUERY, timeout=5)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError,
+                    asyncpg.InterfaceError) as e:
+                if replica.healthy:
+                    log.warning("Replica %d is unavailable: %r", replica.index, e)
+                replica.healthy = False
+                continue
+            if not replica.healthy:
+                log.info("Replica %d is available, lag %.3fs", replica.index, replica.lag)
+            replica.healthy = True
+            self.replica_lag.labels(replica=str(replica.index)).set(replica.lag)
+
+    def _pick_replica(self):
+        max_lag = self.max_replica_lag()
+        for _ in range(len(self._replicas)):
+            replica = self._replicas[self._next_replica % len(self._replicas)]
+            self._next_replica += 1
+            if replica.healthy and replica.lag is not None and replica.lag <= max_lag:
+                return replica
+
+    def observe_query(self, query, elapsed, rows, caller):
+        fp = fingerprint(query)[:200]
+        self.query_timing.labels(query=fp).observe(elapsed)
+        self.query_rows.labels(query=fp).inc(rows)
+        if elapsed >= self.slow_query_threshold():
+            log.warning("Slow query (%.3fs, %d rows) from %s: %s",
+                        elapsed, rows, caller, query[:1000])
+
+    def acquire(self, readonly=False):
+        """Acquire a connection.
 
-    def acquire(self):
-        return AsyncContextWrapper(self._acquire())
+        readonly connections may come from a replica, don't write with them or
+        expect them to see writes made in the last `max_replica_lag` seconds.
+        """
+        caller = sys._getframe(1).f_globals.get("__name__", "?").rpartition(".")[2]
+        return _InstrumentedAcquire(self, caller, readonly)
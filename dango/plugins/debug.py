@@ -14,9 +14,11 @@ import sys
 
 import aiohttp
 from dango import dcog, Cog
+from dango.core import COG_DESC
 import discord
 from discord.ext.commands import command, errors
 import objgraph
+import tabulate
 
 from .common import converters
 from .common import checks
@@ -99,7 +101,40 @@ class Debug(Cog):
 
     @command()
     async def cogs(self, ctx):
-        await ctx.send(", ".join(sorted(ctx.bot.cogs.keys())))
+        """Show loaded and deferred cogs and what they depend on."""
+        deps = ctx.bot._cog_deps
+        rows = []
+        for name in sorted(set(ctx.bot.cogs) | set(deps.deferred)):
+            cog_desc = getattr(ctx.bot.cogs.get(name), COG_DESC, None)
+            rows.append((
+                name,
+                "loaded" if name in ctx.bot.cogs else "deferred",
+                "%.0f" % (cog_desc.load_duration * 1000) if cog_desc else "",
+                ", ".join(deps.depends.get(name, ())),
+                ", ".join(sorted(deps.dependants.get(name, ()))),
+            ))
+        out = tabulate.tabulate(rows, headers=("cog", "state", "load ms", "depends", "dependants"))
+        for cycle in deps.cycles():
+            out += "\ncycle: " + " -> ".join(cycle)
+        await ctx.send("```{}```".format(out))
+
+    @command()
+    @checks.is_owner()
+    async def startup(self, ctx, count: int=10):
+        """Show where startup time went."""
+        profile = ctx.bot.startup_profile
+        out = "ready after: {}\n".format(
+            "{:.2f}s".format(profile.ready) if profile.ready is not None else "not yet")
+        out += "\n".join("{}: {:.2f}s".format(spec, t) for spec, t in profile.specs.items())
+        out += "\n\n" + tabulate.tabulate(
+            [(name, "%.1f" % (s * 1000), "%.1f" % (t * 1000))
+             for name, (s, t) in profile.slowest_imports(count)],
+            headers=("module", "self ms", "total ms"))
+        out += "\n\n" + tabulate.tabulate(
+            [(name, "%.1f" % (c * 1000), "%.1f" % (l * 1000))
+             for name, c, l in profile.slowest_cogs(count)],
+            headers=("cog", "constructor ms", "cog_load ms"))
+        await ctx.send("```{}```".format(out))
 
     @command()
     async def shard_id(self, ctx, shard_count:int=None, guild_id:int=None):
@@ -150,11 +185,12 @@ class Debug(Cog):
         """Reloads an extension.
         """
         try:
-            try:
-                ctx.bot.unload_extension(extension)
-            except errors.ExtensionNotLoaded:
-                pass
-            ctx.bot.load_extension(extension)
+            with ctx.bot.state_handoff():
+                try:
+                    await ctx.bot.unload_extension(extension)
+                except errors.ExtensionNotLoaded:
+                    pass
+                await ctx.bot.load_extension(extension)
         except BaseException:
             await ctx.send("\N{THUMBS DOWN SIGN}")
             raise
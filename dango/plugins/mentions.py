@@ -127,7 +127,7 @@ class Mentions(Cog):
                          str(mention), mention.id, mode)
                 await self.attr.set_attributes(mention, pm_mentions_mode=PmMentionMode.off.value)
 
-    @Cog.listener()
+    @Cog.listener(lane="mentions", max_concurrency=8)
     async def on_message(self, message):
         if isinstance(message.channel, discord.DMChannel) or not message.mentions or message.author.id == self.bot.user.id:
             return
@@ -13,6 +13,7 @@ import discord
 import prometheus_client
 import psutil
 
+from .common import prometheus
 from .common import utils
 
 log = logging.getLogger(__name__)
@@ -173,23 +174,11 @@ class HttpClientRequestHook:
 class PrometheusMetrics(Cog):
 
     def get_prom(self, name):
-        try:
-            return prometheus_client.REGISTRY._names_to_collectors[name]
-        except KeyError:
-            for key, value in prometheus_client.REGISTRY._collector_to_names.items():
-                for val in value:
-                    if val.startswith(name):
-                        return key
-        raise KeyError
+        return prometheus.get_metric(name)
 
     def declare_metric(self, name, type, *args, namespace="dango", function=None, **kwargs):
-        try:
-            setattr(self, name, type(name, *args, namespace=namespace, **kwargs))
-        except ValueError:  # Already exists
-            setattr(self, name, self.get_prom(namespace + "_" + name))
-
-        if function:
-            getattr(self, name).set_function(function)
+        setattr(self, name, prometheus.declare_metric(
+            name, type, *args, namespace=namespace, function=function, **kwargs))
 
     def __init__(self, bot, config, http):
         self.declare_metric(
@@ -216,6 +205,21 @@ class PrometheusMetrics(Cog):
             self.member_count.labels(status=status.name).set_function(
                 self._member_count_factory(status))
 
+        self.declare_metric(
+            "startup_ready_seconds", prometheus_client.Gauge, "Seconds from startup to first ready",
+            function=lambda: bot.startup_profile.ready or 0)
+        self.declare_metric(
+            "startup_import_seconds", prometheus_client.Gauge,
+            "Import time of the slowest modules, excluding their imports", ['module'])
+        self.declare_metric(
+            "startup_cog_seconds", prometheus_client.Gauge, "Cog load time", ['cog', 'phase'])
+        self.declare_metric(
+            "listener_lane_events", prometheus_client.Gauge,
+            "Listener events running or queued per lane", ['lane', 'state'])
+        self.declare_metric(
+            "listener_lane_dropped", prometheus_client.Gauge,
+            "Listener events dropped by a full lane since startup", ['lane'])
+
         self._member_counts = {
             status: 0 for status in discord.Status
         }
@@ -290,6 +294,8 @@ class PrometheusMetrics(Cog):
         """aiohttp handler for Prometheus metrics."""
 
         registry = prometheus_client.REGISTRY
+        self._update_startup_metrics()
+        self._update_lane_metrics()
 
         if 'name[]' in req.query:
             registry = registry.restricted_registry(req.query['name[]'])
@@ -300,6 +306,21 @@ class PrometheusMetrics(Cog):
             body=output,
             headers={'Content-Type': prometheus_client.CONTENT_TYPE_LATEST})
 
+    def _update_startup_metrics(self):
+        profile = self.bot.startup_profile
+        self.startup_import_seconds.clear()
+        for module, (self_time, _) in profile.slowest_imports(20):
+            self.startup_import_seconds.labels(module=module).set(self_time)
+        for cog, constructor, cog_load in profile.slowest_cogs(len(self.bot.cogs)):
+            self.startup_cog_seconds.labels(cog=cog, phase="constructor").set(constructor)
+            self.startup_cog_seconds.labels(cog=cog, phase="cog_load").set(cog_load)
+
+    def _update_lane_metrics(self):
+        for name, lane in self.bot.lanes.items():
+            self.listener_lane_events.labels(lane=name, state="running").set(lane.running)
+            self.listener_lane_events.labels(lane=name, state="queued").set(lane.queued)
+            self.listener_lane_dropped.labels(lane=name).set(lane.dropped)
+
     @Cog.listener()
     async def on_socket_response(self, data):
         opcode = data['op']
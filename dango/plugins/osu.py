@@ -103,6 +103,16 @@ class Osu(Cog):
     def cog_unload(self):
         self.osuapi.close()
 
+    def __dango_export_state__(self):
+        return {
+            "beatmaps": self._beatmap_cache.items(),
+            "presence_usernames": self._osu_presence_username_cache.items(),
+        }
+
+    def __dango_import_state__(self, state):
+        utils.restore_lru(self._beatmap_cache, state["beatmaps"])
+        utils.restore_lru(self._osu_presence_username_cache, state["presence_usernames"])
+
     async def _set_osu_username(self, user, username):
         """Set :user's osu account to :username. Returns api result."""
         osu_acct = await self._lookup_acct(username)
@@ -1,16 +1,226 @@
 import asyncio
 import logging
+import time
 
 import aioredis
 from dango import dcog, Cog
+from discord.ext.commands import command
+from lru import LRU
+import prometheus_client
+import tabulate
 
+from .common import checks
+from .common import prometheus
+from .common import sharding
 from .common import utils
 
 log = logging.getLogger(__name__)
 
+_MISSING = object()
+
+
+def _key_str(key):
+    return key.decode('utf8') if isinstance(key, bytes) else key
+
+
+class NearCachePrefix:
+    """LRU + TTL cache for keys starting with prefix."""
+
+    def __init__(self, prefix, size, ttl):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation, so reads that raced one aren't stored.
+        self.generation = 0
+        self._lru = LRU(size)
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, generation):
+        if generation == self.generation:
+            self._lru[key] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, key):
+        self.generation += 1
+        try:
+            del self._lru[key]
+        except KeyError:
+            pass
+
+    def clear(self):
+        self.generation += 1
+        self._lru.clear()
+
+
+class NearCache:
+    """Client side cache for configured key prefixes.
+
+    Kept consistent with redis by keyspace notifications, so the server
+    needs notify-keyspace-events to include K and the events for the
+    commands used on cached keys (e.g. "K$gx"). Entries also expire after
+    their prefix's ttl, which bounds staleness if notifications are missed.
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = prefixes
+
+    def lookup(self, key):
+        key = _key_str(key)
+        for prefix in self.prefixes:
+            if key.startswith(prefix.prefix):
+                return prefix, key
+        return None, key
+
+    def invalidate(self, key):
+        prefix, key = self.lookup(key)
+        if prefix:
+            prefix.invalidate(key)
+
+    def clear(self):
+        for prefix in self.prefixes:
+            prefix.clear()
+
+
+class NearCachedClient:
+    """Redis client wrapper that serves get/mget from a NearCache.
+
+    Writes through this client invalidate the local entries. Everything else
+    is passed through to the real client.
+    """
+
+    def __init__(self, client, cache):
+        self._client = client
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def __aenter__(self):
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        return await self._client.__aexit__(*args, **kwargs)
+
+    async def get(self, key):
+        prefix, skey = self._cache.lookup(key)
+        if not prefix:
+            return await self._client.get(key)
+        value = prefix.get(skey)
+        if value is not _MISSING:
+            return value
+        generation = prefix.generation
+        value = await self._client.get(key)
+        prefix.put(skey, value, generation)
+        return value
+
+    async def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        keys.extend(args)
+
+        results = [None] * len(keys)
+        misses = []
+        for idx, key in enumerate(keys):
+            prefix, skey = self._cache.lookup(key)
+            value = prefix.get(skey) if prefix else _MISSING
+            if value is _MISSING:
+                misses.append((idx, key, prefix, skey, prefix and prefix.generation))
+            else:
+                results[idx] = value
+
+        if misses:
+            values = await self._client.mget([key for _, key, _, _, _ in misses])
+            for (idx, _, prefix, skey, generation), value in zip(misses, values):
+                results[idx] = value
+                if prefix:
+                    prefix.put(skey, value, generation)
+        return results
+
+    async def set(self, name, *args, **kwargs):
+        try:
+            return await self._client.set(name, *args, **kwargs)
+        finally:
+            self._cache.invalidate(name)
+
+    async def mset(self, mapping):
+        try:
+            return await self._client.mset(mapping)
+        finally:
+            for key in mapping:
+                self._cache.invalidate(key)
+
+    async def delete(self, *names):
+        try:
+            return await self._client.delete(*names)
+        finally:
+            for name in names:
+                self._cache.invalidate(name)
+
+    async def flushdb(self, *args, **kwargs):
+        try:
+            return await self._client.flushdb(*args, **kwargs)
+        finally:
+            self._cache.clear()
+
+
+class CountingConnectionPool(aioredis.BlockingConnectionPool):
+    """Blocking pool that keeps track of in-use connections and waiters."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # get_connection releases connections it fails to set up itself, so
+        # track checked out connections rather than keeping a counter.
+        self._checked_out = set()
+        self.waiting = 0
+
+    @property
+    def in_use(self):
+        return len(self._checked_out)
+
+    @property
+    def idle(self):
+        return len(self._connections) - self.in_use
+
+    async def get_connection(self, *args, **kwargs):
+        self.waiting += 1
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        finally:
+            self.waiting -= 1
+        self._checked_out.add(id(connection))
+        return connection
+
+    async def release(self, connection):
+        self._checked_out.discard(id(connection))
+        await super().release(connection)
+
 
 @dcog()
 class Redis(Cog):
+    """aioredis client.
+
+    Commands share a pool of at most `maxsize` connections, `minsize` of
+    which are opened on load. Commands wait up to `acquire_timeout` seconds
+    for a free connection, and `command_timeout` (seconds, 0 for none) bounds
+    each command.
+
+    `near_cache` maps key prefixes to {size, ttl}. get/mget of matching keys
+    through `acquire` are served from a NearCache when possible, e.g.
+
+        near_cache:
+          "spoo:last_username:": {size: 50000, ttl: 300}
+
+    `nodes` is an optional list of "host:port/db" to shard keys across with
+    consistent hashing, in which case host/port/db are ignored and `acquire`
+    returns a ShardedClient. Pool sizes are per node.
+    """
 
     def __init__(self, config):
         self.host = config.register("host", default="localhost")
@@ -18,18 +228,134 @@ class Redis(Cog):
         self.db = config.register("db", default=0)
         self.minsize = config.register("minsize", default=1)
         self.maxsize = config.register("maxsize", default=10)
+        self.acquire_timeout = config.register("acquire_timeout", default=20)
+        self.command_timeout = config.register("command_timeout", default=0)
+        self.near_cache = config.register("near_cache", default={})
+        self.nodes = config.register("nodes", default=[])
+
+        self._near_cache = None
+        self._near_cache_tasks = []
+        if self.near_cache():
+            self._near_cache = NearCache([
+                NearCachePrefix(str(prefix), int(opts.get("size", 10000)), float(opts.get("ttl", 60)))
+                for prefix, opts in self.near_cache().items()])
+
+        self._node_names = [str(node) for node in self.nodes()] or [
+            "%s:%s/%s" % (self.host(), self.port(), self.db())]
+        self._ring = sharding.HashRing(self._node_names)
+        self._connection_pools = []
+        self._clients = []
+        self.pool_connections = prometheus.declare_metric(
+            "redis_pool_connections", prometheus_client.Gauge,
+            "Redis pool connections", ["state"])
+        self.pool_connections.labels(state="in_use").set_function(
+            lambda: sum(pool.in_use for pool in self._connection_pools))
+        self.pool_connections.labels(state="idle").set_function(
+            lambda: sum(pool.idle for pool in self._connection_pools))
+        self.pool_waiters = prometheus.declare_metric(
+            "redis_pool_waiters", prometheus_client.Gauge,
+            "Commands waiting for a redis connection",
+            function=lambda: sum(pool.waiting for pool in self._connection_pools))
+        self.near_cache_lookups = prometheus.declare_metric(
+            "redis_near_cache_lookups", prometheus_client.Gauge,
+            "Near cache lookups since load", ["prefix", "result"])
+        for prefix in self._near_cache.prefixes if self._near_cache else []:
+            self.near_cache_lookups.labels(prefix=prefix.prefix, result="hit").set_function(
+                lambda prefix=prefix: prefix.hits)
+            self.near_cache_lookups.labels(prefix=prefix.prefix, result="miss").set_function(
+                lambda prefix=prefix: prefix.misses)
 
     async def cog_load(self):
-        self._pool = await aioredis.from_url(
-            f"redis://{self.host()}:{self.port()}/{self.db()}",
-            decode_responses=False
-        )
+        for node in self._node_names:
+            pool = CountingConnectionPool.from_url(
+                f"redis://{node}",
+                max_connections=self.maxsize(),
+                timeout=self.acquire_timeout(),
+                socket_timeout=self.command_timeout() or None,
+                decode_responses=False
+            )
+            self._connection_pools.append(pool)
+            self._clients.append(aioredis.Redis(connection_pool=pool))
+
+            # Open minsize connections up front.
+            connections = [
+                await pool.get_connection("PING")
+                for _ in range(min(self.minsize(), self.maxsize()))]
+            for connection in connections:
+                await pool.release(connection)
+        self._pool = self._clients[0]
+
+        if self._near_cache:
+            self._near_cache_tasks = []
+            for client in self._clients:
+                await self._check_keyspace_events(client)
+                self._near_cache_tasks.append(
+                    utils.create_task(self.near_cache_invalidator(client)))
 
     async def cog_unload(self):
-        await self._pool.close()
+        for task in self._near_cache_tasks:
+            task.cancel()
+        for client, pool in zip(self._clients, self._connection_pools):
+            await client.close()
+            await pool.disconnect()
+
+    async def _check_keyspace_events(self, client):
+        try:
+            res = await client.config_get("notify-keyspace-events")
+            flags = _key_str(next(iter(res.values()), b""))
+        except aioredis.RedisError:
+            log.warning("Couldn't check notify-keyspace-events, near cache "
+                        "may be stale until entries expire.")
+            return
+        if "K" not in flags or not ("A" in flags or all(c in flags for c in "$gx")):
+            log.warning("notify-keyspace-events is %r, near cache will be stale "
+                        "until entries expire. Set it to at least 'K$gx'.", flags)
+
+    async def near_cache_invalidator(self, client):
+        """Invalidate near cache entries on a node's keyspace notifications."""
+        channel_prefix = "__keyspace@%d__:" % client.connection_pool.connection_kwargs.get("db", 0)
+        patterns = [channel_prefix + prefix.prefix + "*" for prefix in self._near_cache.prefixes]
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(*patterns)
+                # We may have missed notifications while (re)connecting.
+                self._near_cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    self._near_cache.invalidate(
+                        _key_str(message["channel"])[len(channel_prefix):])
+            except aioredis.RedisError:
+                log.exception("Near cache invalidation connection lost, retrying")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
 
     async def _acquire(self):
-        return self._pool.client()
+        if len(self._clients) > 1:
+            client = sharding.ShardedClient(
+                [client.client() for client in self._clients], self._ring)
+        else:
+            client = self._pool.client()
+        if self._near_cache:
+            return NearCachedClient(client, self._near_cache)
+        return client
 
     def acquire(self):
         return utils.AsyncContextWrapper(self._acquire())
+
+    @command()
+    @checks.is_owner()
+    async def nearcache(self, ctx):
+        """Show near cache hit ratios."""
+        if not self._near_cache:
+            await ctx.send("Near cache is disabled.")
+            return
+        rows = [
+            (prefix.prefix, len(prefix._lru), prefix.hits, prefix.misses,
+             "%.1f%%" % (100 * prefix.hits / ((prefix.hits + prefix.misses) or 1)))
+            for prefix in self._near_cache.prefixes]
+        lines = tabulate.tabulate(
+            rows, headers=["Prefix", "Size", "Hits", "Misses", "Ratio"], tablefmt="simple")
+        await ctx.send("```prolog\n{}```".format(lines))
@@ -109,6 +109,32 @@ class Tracking(Cog):
         self.batch_name_task.cancel()
         await self.batch_name_task
 
+    def __dango_export_state__(self):
+        """Hand queued writes and the pin cache to the reloaded cog.
+
+        The queues are emptied here so cog_unload's final flush doesn't
+        write them as well; only a batch mid-insert is left to it.
+        """
+        state = {
+            "last_spoke": self._batch_last_spoke_curr_updates + self.batch_last_spoke_updates,
+            "last_seen": self._batch_last_seen_curr_updates + self.batch_last_seen_updates,
+            "names": self._batch_name_curr_updates + self.batch_name_updates,
+            "recent_pins": self._recent_pins.items(),
+        }
+        self._batch_last_spoke_curr_updates = []
+        self.batch_last_spoke_updates = []
+        self._batch_last_seen_curr_updates = []
+        self.batch_last_seen_updates = []
+        self._batch_name_curr_updates = []
+        self.batch_name_updates = []
+        return state
+
+    def __dango_import_state__(self, state):
+        self.batch_last_spoke_updates[:0] = state["last_spoke"]
+        self.batch_last_seen_updates[:0] = state["last_seen"]
+        self.batch_name_updates[:0] = state["names"]
+        utils.restore_lru(self._recent_pins, state["recent_pins"])
+
     async def batch_presence(self):
         try:    
             while True:
@@ -183,7 +209,7 @@ class Tracking(Cog):
         return last_name
 
     async def names_for(self, member, since: timedelta=None):
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             params = []
             query = (
                 "SELECT name, idx FROM namechanges "
@@ -212,7 +238,7 @@ class Tracking(Cog):
             return []
 
     async def nicks_for(self, member, since: timedelta=None):
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             params = []
             query = (
                 "SELECT name, idx FROM nickchanges "
@@ -317,6 +343,7 @@ class Tracking(Cog):
 
             await self.batch_insert_name_updates(name_inserts, nick_inserts)
             await self.batch_set_redis_names(current_names, current_nicks)
+        self._batch_name_curr_updates = []
 
     async def batch_get_redis_mismatch(self, updates):
         assert 0 < len(updates) <= 50000  # Limit mget to 100k keys.
@@ -438,7 +465,7 @@ class Tracking(Cog):
     # Presence tracking
     async def last_seen(self, member: Union[discord.User, discord.Member]) -> LastSeenTuple:
         """Lookup last_seen data."""
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             last_seen = await conn.fetchval(
                 "SELECT date from last_seen WHERE id = $1 LIMIT 1", member.id)
             last_spoke  = await conn.fetchval(
@@ -463,7 +490,7 @@ class Tracking(Cog):
         ids = [m.id for m in members]
         guild_id = members[0].guild.id
 
-        async with self.database.acquire() as conn:
+        async with self.database.acquire(readonly=True) as conn:
             last_seens = {
                 member_id: date for member_id, date in await conn.fetch(
                 "SELECT id, date from last_seen WHERE id = ANY($1)",
@@ -627,7 +654,7 @@ class Tracking(Cog):
             self.queue_batch_last_update(member)
         self.queue_batch_names_update(member)
 
-    @Cog.listener()
+    @Cog.listener(lane="database", max_concurrency=4)
     async def on_member_join(self, member):
         await asyncio.gather(
             self.update_last_update(member),
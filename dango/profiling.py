@@ -0,0 +1,105 @@
+"""Where startup time goes.
+
+The bot keeps a StartupProfile: import time per module (while loading
+extensions), constructor and cog_load time per cog, time per plugin spec
+and time until the first on_ready.
+"""
+import importlib.abc
+import sys
+import time
+
+
+class _TimedLoader:
+    """Wraps a loader to time exec_module."""
+
+    def __init__(self, loader, timer, name):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.exit(self._name)
+            # Don't leave the wrapper on the module.
+            module.__loader__ = self._loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self._loader
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Records how long each module imported inside the block takes.
+
+    times maps a module name to (self seconds, total seconds), where total
+    includes the modules it imported for the first time.
+    """
+
+    def __init__(self, times):
+        self.times = times
+        self._stack = []
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *args):
+        sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or not find_spec:
+                continue
+            spec = find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self, name)
+        return spec
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0])
+
+    def exit(self, name):
+        start, children = self._stack.pop()
+        total = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][1] += total
+        self.times[name] = (total - children, total)
+
+
+class StartupProfile:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {}  # module -> (self seconds, total seconds)
+        self.specs = {}  # plugin spec -> seconds
+        self.constructors = {}  # cog -> seconds
+        self.cog_loads = {}  # cog -> seconds
+        self.ready = None  # seconds from bot creation to first on_ready
+
+    def import_timer(self):
+        return ImportTimer(self.imports)
+
+    def mark_ready(self):
+        if self.ready is None:
+            self.ready = time.perf_counter() - self.started
+
+    def slowest_imports(self, count=10):
+        return sorted(self.imports.items(), key=lambda i: -i[1][0])[:count]
+
+    def slowest_cogs(self, count=10):
+        cogs = set(self.constructors) | set(self.cog_loads)
+        return sorted(
+            ((cog, self.constructors.get(cog, 0), self.cog_loads.get(cog, 0)) for cog in cogs),
+            key=lambda c: -(c[1] + c[2]))[:count]
@@ -2,5 +2,9 @@ CREATE TABLE attributes (
     id character varying NOT NULL,
     type character varying NOT NULL,
     data jsonb,
+    last_access timestamp with time zone,
     PRIMARY KEY (id, type)
 );
+
+CREATE INDEX attributes_last_access_idx ON attributes (last_access DESC NULLS LAST);
+CREATE INDEX attributes_data_idx ON attributes USING GIN (data jsonb_path_ops);
@@ -0,0 +1 @@
+create index concurrently attributes_data_idx on attributes using gin (data jsonb_path_ops);
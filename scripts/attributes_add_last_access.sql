@@ -0,0 +1,4 @@
+start transaction;
+alter table attributes add column last_access timestamp with time zone;
+create index attributes_last_access_idx on attributes (last_access desc nulls last);
+commit transaction;
@@ -69,7 +69,7 @@ class ConfigTest(unittest.TestCase):
 
         self.assertEqual(stuff(), 1)
 
-        c._data['a']['stuff'] = 3
+        c.set(["a", "stuff"], 3)
 
         self.assertEqual(stuff(), 3)
 
@@ -85,10 +85,20 @@ class ConfigTest(unittest.TestCase):
 
         self.assertEqual(a.stuff(), 1)
 
-        c._data['a']['stuff'] = 3
+        c.set(["a", "stuff"], 3)
 
         self.assertEqual(a.stuff(), 3)
 
+    def test_value_cached(self):
+        c = config.StringConfiguration(SAMPLE_CONFIG)
+        stuff = c.root.add_group("a").register("stuff")
+        self.assertEqual(1, stuff())
+
+        c._data["a"]["stuff"] = 3  # Behind its back
+        self.assertEqual(1, stuff())
+        c.set(["a", "stuff"], 4)
+        self.assertEqual(4, stuff())
+
 
 class FileConfigurationTest(unittest.TestCase):
 
@@ -108,3 +118,79 @@ class FileConfigurationTest(unittest.TestCase):
 
         with open(self.tmpfile, encoding="utf8") as f:
             self.assertEqual(SAMPLE_COMMENTED_CONFIG, f.read())
+
+    def test_save_only_when_dirty(self):
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write(SAMPLE_CONFIG)
+
+        fconf = config.FileConfiguration(self.tmpfile)
+        fconf.load()
+        fconf.root.add_group("a").register("stuff", default=2)
+        self.assertFalse(fconf.dirty)
+        fconf.save()
+        with open(self.tmpfile, encoding="utf8") as f:
+            self.assertEqual(SAMPLE_CONFIG, f.read())
+
+        fconf.root.add_group("b").register("stuff", default=2)
+        self.assertTrue(fconf.dirty)
+        fconf.save()
+        self.assertFalse(fconf.dirty)
+        with open(self.tmpfile, encoding="utf8") as f:
+            self.assertIn("stuff: 2  # Default value", f.read())
+
+    def test_load_cached_until_file_changes(self):
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write(SAMPLE_CONFIG)
+
+        fconf = config.FileConfiguration(self.tmpfile)
+        fconf.load()
+        stuff = fconf.root.add_group("a").register("stuff", default=2)
+        data = fconf._data
+        fconf.load()
+        self.assertIs(data, fconf._data)
+
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write("a:\n  stuff: 10\n")
+        fconf.load()
+        self.assertEqual(10, stuff())
+
+    def test_reload_restores_defaults(self):
+        fconf = config.FileConfiguration(self.tmpfile)
+        fconf.load()
+        other = fconf.root.add_group("b").register("other", default=3)
+        fconf.save()
+
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write("a: 1\n")
+        fconf.load()
+        self.assertEqual(3, other())
+        self.assertTrue(fconf.dirty)
+
+    def test_change_callbacks(self):
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write("a:\n  stuff: 1\n  other: 2\n")
+
+        fconf = config.FileConfiguration(self.tmpfile)
+        fconf.load()
+        group = fconf.root.add_group("a")
+        stuff = group.register("stuff")
+        other = group.register("other")
+        changes = []
+        stuff.on_change(lambda value: changes.append(("stuff", value)))
+        other.on_change(lambda value: changes.append(("other", value)))
+
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write("a:\n  stuff: 5\n  other: 2\n  extra: 1\n")
+        os.utime(self.tmpfile, ns=(1, 1))
+        fconf.load()
+        self.assertEqual([("stuff", 5)], changes)
+        self.assertEqual(5, stuff())
+
+        # A file that doesn't parse keeps the old values.
+        with open(self.tmpfile, 'w', encoding="utf8") as f:
+            f.write("a: [\n")
+        os.utime(self.tmpfile, ns=(2, 2))
+        with self.assertRaises(Exception):
+            fconf.load()
+        self.assertEqual(5, stuff())
+        self.assertEqual([("stuff", 5)], changes)
@@ -1,5 +1,6 @@
 import asyncio
 import sys
+import time
 import unittest
 
 from dango import core
@@ -35,6 +36,23 @@ class C(Cog):
         self.b = b
 
 
+@dcog(depends=["A"])
+class Stateful(Cog):
+    def __init__(self, config, a):
+        self.queue = []
+        self.loaded_with = None
+
+    async def cog_load(self):
+        self.loaded_with = list(self.queue)
+
+    def __dango_export_state__(self):
+        state, self.queue = self.queue, []
+        return state
+
+    def __dango_import_state__(self, state):
+        self.queue[:0] = state
+
+
 class TestPluginLoading(unittest.TestCase):
 
     def setUp(self):
@@ -137,6 +155,76 @@ class TestPluginLoading(unittest.TestCase):
         self.assertIn("C", b.cogs)
         self.assertEqual(0, len(b._dango_unloaded_cogs))
 
+    @async_test
+    async def test_state_handoff(self):
+        b = self.b
+
+        await b.add_cog(A)
+        await b.add_cog(Stateful)
+        old = b.get_cog("Stateful")
+        old.queue.extend([1, 2])
+
+        # Unloading A takes its dependant down too.
+        with b.state_handoff():
+            await b.remove_cog("A")
+            await b.add_cog(A)
+
+        new = b.get_cog("Stateful")
+        self.assertIsNot(old, new)
+        self.assertEqual([], old.queue)
+        self.assertEqual([1, 2], new.queue)
+        self.assertEqual([1, 2], new.loaded_with)  # Imported before cog_load
+        self.assertIsNone(b._cog_state)
+
+    @async_test
+    async def test_no_state_handoff_outside_block(self):
+        b = self.b
+
+        await b.add_cog(A)
+        await b.add_cog(Stateful)
+        b.get_cog("Stateful").queue.append(1)
+
+        await b.remove_cog("Stateful")
+        await b.add_cog(Stateful)
+
+        self.assertEqual([], b.get_cog("Stateful").queue)
+
+
+class TestCogDependencyRegister(unittest.TestCase):
+
+    def setUp(self):
+        self.deps = core.CogDependencyRegister()
+        self.deps.add("A", [])
+        self.deps.add("B", ["A"])
+        self.deps.add("C", ["B"])
+        self.deps.add("D", ["A"])
+
+    def test_ready_after_dependencies(self):
+        self.deps.defer(B)
+        self.deps.defer(C)
+        self.assertEqual([B], self.deps.mark_loaded("A"))
+        self.assertEqual([C], self.deps.mark_loaded("B"))
+        self.assertFalse(self.deps.deferred)
+
+    def test_unload_order(self):
+        for name in "ABCD":
+            self.deps.mark_loaded(name)
+        order = self.deps.unload_order("A")
+        self.assertEqual({"B", "C", "D"}, set(order))
+        self.assertLess(order.index("C"), order.index("B"))
+
+        self.deps.mark_unloaded("D")
+        self.assertNotIn("D", self.deps.unload_order("A"))
+        self.assertEqual([], self.deps.unload_order("C"))
+
+    def test_cycles(self):
+        self.assertEqual([], self.deps.cycles())
+        self.deps.add("A", ["C"])
+        cycles = self.deps.cycles()
+        self.assertEqual(1, len(cycles))
+        self.assertEqual(cycles[0][0], cycles[0][-1])
+        self.assertEqual({"A", "B", "C"}, set(cycles[0]))
+
 
 class TestExtensionLoading(unittest.TestCase):
 
@@ -174,6 +262,20 @@ class TestExtensionLoading(unittest.TestCase):
         self.assertIn("E", b.cogs)
         self.assertEqual(0, len(b._dango_unloaded_cogs))
 
+    @async_test
+    async def test_load_concurrently(self):
+        b = self.b
+
+        start = time.perf_counter()
+        await b.load_extensions(["test_data.slow_extension", "test_data.core_test_extension"])
+        elapsed = time.perf_counter() - start
+
+        for name in ("A", "B", "C", "SlowA", "SlowB", "SlowC"):
+            self.assertIn(name, b.cogs)
+        self.assertIn("test_data.slow_extension", b.extensions)
+        # SlowA -> SlowC is the critical path, SlowB loads alongside SlowA.
+        self.assertLess(elapsed, 0.55)
+
     @async_test
     async def test_unload(self):
         b = self.b
@@ -0,0 +1,187 @@
+import asyncio
+import unittest
+
+from dango import config
+from dango.plugins import database
+
+
+conf = config.StringConfiguration("""
+database:
+  dsn: postgresql://@localhost/spootest
+""")
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        coro = f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro)
+    return wrapper
+
+
+class FakeConnection:
+
+    async def execute(self, query, *args):
+        return "INSERT 0 %d" % (len(args) // 2)
+
+    async def fetch(self, query, *args):
+        return [(1,), (2,), (3,)]
+
+    async def fetchval(self, query, *args):
+        return None
+
+
+class FakeAcquire:
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        if self.engine.broken:
+            raise OSError("connection refused")
+        return self.engine.conn
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeEngine:
+
+    def __init__(self, broken=False):
+        self.conn = FakeConnection()
+        self.broken = broken
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_placeholders(self):
+        self.assertEqual(
+            "SELECT name from namechanges WHERE id = ? ORDER BY idx DESC LIMIT ?",
+            database.fingerprint(
+                "SELECT name from namechanges WHERE id = $1 "
+                "ORDER BY idx DESC LIMIT 1"))
+
+    def test_string_literals(self):
+        self.assertEqual(
+            "SELECT * FROM a WHERE b = ? AND c = ?",
+            database.fingerprint("SELECT * FROM a WHERE b = 'it''s' AND c = 'x'"))
+
+    def test_multi_insert_sizes_match(self):
+        small = [(1, 2)] * 2
+        big = [(1, 2)] * 500
+        query = "INSERT INTO last_seen (id, date) VALUES %s ON CONFLICT DO NOTHING"
+        self.assertEqual(
+            "INSERT INTO last_seen (id, date) VALUES (?, ?), ... ON CONFLICT DO NOTHING",
+            database.fingerprint(query % database.multi_insert_str(small)))
+        self.assertEqual(
+            database.fingerprint(query % database.multi_insert_str(small)),
+            database.fingerprint(query % database.multi_insert_str(big)))
+
+
+class TestInstrumentedConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database.Database(conf.root.add_group("database"))
+        self.observed = []
+        self.db.observe_query = lambda *args: self.observed.append(args)
+        self.conn = database.InstrumentedConnection(FakeConnection(), self.db, "test")
+
+    @async_test
+    async def test_rows(self):
+        await self.conn.execute("INSERT INTO a VALUES ($1, $2), ($3, $4)", 1, 2, 3, 4)
+        await self.conn.fetch("SELECT 1")
+        await self.conn.fetchval("SELECT 1")
+
+        self.assertEqual([2, 3, 0], [rows for _, _, rows, _ in self.observed])
+        self.assertEqual({"test"}, {caller for _, _, _, caller in self.observed})
+
+
+class TestReadonlyRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database.Database(conf.root.add_group("database"))
+        self.db._engine = FakeEngine()
+        self.replicas = [database.Replica(0, "a"), database.Replica(1, "b")]
+        for replica in self.replicas:
+            replica.engine = FakeEngine()
+            replica.healthy = True
+            replica.lag = 0
+        self.db._replicas = self.replicas
+
+    async def served_by(self, readonly=True):
+        async with self.db.acquire(readonly=readonly) as conn:
+            return conn._conn
+
+    @async_test
+    async def test_round_robin(self):
+        served = [await self.served_by() for _ in range(4)]
+        self.assertEqual([r.engine.conn for r in self.replicas] * 2, served)
+        self.assertIs(self.db._engine.conn, await self.served_by(readonly=False))
+
+    @async_test
+    async def test_skips_lagging(self):
+        self.replicas[0].lag = 60
+        served = [await self.served_by() for _ in range(2)]
+        self.assertEqual([self.replicas[1].engine.conn] * 2, served)
+
+        self.replicas[1].healthy = False
+        self.assertIs(self.db._engine.conn, await self.served_by())
+
+    @async_test
+    async def test_falls_back_on_error(self):
+        self.replicas[0].engine.broken = True
+        self.replicas[1].healthy = False
+        self.assertIs(self.db._engine.conn, await self.served_by())
+        self.assertFalse(self.replicas[0].healthy)
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+
+    @async_test
+    async def test_blocks_at_limit(self):
+        limit = database.AdaptiveLimit(1, 2, target_wait=0.01)
+        await limit.acquire()
+
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+        self.assertEqual(1, limit.waiting)
+
+        limit.release()
+        await waiter
+        self.assertEqual(1, limit.in_use)
+        self.assertEqual(0, limit.waiting)
+
+    @async_test
+    async def test_cancelled_waiter(self):
+        limit = database.AdaptiveLimit(1, 2, target_wait=0.01)
+        await limit.acquire()
+
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        limit.release()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(0, limit.in_use)
+
+    def test_grows_and_shrinks(self):
+        limit = database.AdaptiveLimit(1, 3, target_wait=0.01, window=10)
+        for _ in range(20):
+            limit.record_wait(1)
+        self.assertEqual(3, limit.limit)
+
+        for _ in range(10):
+            limit.record_wait(1)
+        self.assertEqual(3, limit.limit)
+
+        for _ in range(30):
+            limit.record_wait(0)
+        self.assertEqual(1, limit.limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,12 @@
 import asyncio
+import importlib.util
+import os
 import sys
+import tempfile
 import unittest
 
 from dango import core
+from dango import extensions
 from common import setup_logging
 
 loop = asyncio.get_event_loop()
@@ -64,6 +68,130 @@ class PluginDirLoadTest(unittest.TestCase):
         self.assertIn("extension_test_data.extension", b.extensions)
         self.assertIn("UsesCommon", b.cogs)
 
+    @async_test
+    async def test_import_scan_dependants(self):
+        b = self.b
+        await b._loader.watch_spec("extension_test_data.*")
+        register = b._loader._register
+
+        self.assertIn("extension_test_data.common.extras",
+                      register._deps["extension_test_data.late_import"])
+        self.assertIn("extension_test_data.common.utils",
+                      register._deps["extension_test_data.late_import"])
+        self.assertFalse(register._deps["extension_test_data.unrelated_victim"])
+
+        unloaded = await register.unload_extension(
+            "extension_test_data.common", unload_dependants=True)
+        self.assertIn("extension_test_data.late_import", unloaded)
+        self.assertNotIn("extension_test_data.unrelated_victim", unloaded)
+        self.assertNotIn("LateImport", b.cogs)
+
+    @async_test
+    async def test_coalesced_reload(self):
+        b = self.b
+        await b._loader.watch_spec("extension_test_data.*")
+        register = b._loader._register
+        old_cog = b.cogs["UsesCommon"]
+
+        batches = []
+        reload_extensions = register.reload_extensions
+        async def record(names):
+            batches.append(list(names))
+            return await reload_extensions(names)
+        register.reload_extensions = record
+
+        reloads = extensions.ReloadQueue(register, quiet=0.05)
+        reloads.start()
+        try:
+            # A burst from the observer thread, like an editor save.
+            def burst():
+                for _ in range(3):
+                    reloads.put("extension_test_data.extension")
+                    reloads.put("extension_test_data.common")
+            await loop.run_in_executor(None, burst)
+            await asyncio.sleep(0.5)
+        finally:
+            reloads.close()
+
+        self.assertEqual(
+            [["extension_test_data.extension", "extension_test_data.common"]], batches)
+        self.assertIsNot(old_cog, b.cogs["UsesCommon"])
+        # Reloaded after common, so it sees the new module.
+        self.assertIs(
+            sys.modules["extension_test_data.common.utils"],
+            b.extensions["extension_test_data.extension"].utils)
+
+
+class ImportScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "scanned.py")
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.rmdir(self.dir)
+
+    def write(self, source, mtime):
+        with open(self.path, "w") as f:
+            f.write(source)
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_scan_cached_by_mtime(self):
+        scanner = extensions.ImportScanner()
+        spec = importlib.util.spec_from_file_location("pkg.sub.scanned", self.path)
+
+        self.write("import os\nfrom .common import utils as u\n", 1000)
+        self.assertEqual({"os", "pkg.sub.common", "pkg.sub.common.utils"}, scanner.imports(spec))
+
+        # Same mtime, served from cache.
+        self.write("import sys\n", 1000)
+        self.assertIn("os", scanner.imports(spec))
+
+        self.write("def f():\n    from ..other import thing\n", 2000)
+        self.assertEqual({"pkg.other", "pkg.other.thing"}, scanner.imports(spec))
+
+
+class LazyLoadTest(unittest.TestCase):
+
+    def setUpClass():
+        setup_logging()
+
+    def setUp(self):
+        self.manifest = tempfile.mktemp()
+        self.bots = []
+
+    def tearDown(self):
+        for b in self.bots:
+            loop.run_until_complete(b.close())
+        os.remove(self.manifest)
+
+    def make_bot(self):
+        b = core.DangoBot(conf="sample_config.yml")
+        b._loader = extensions.WatchdogExtensionLoader(
+            b, lazy=["extension_test_data.*"], manifest=self.manifest)
+        self.bots.append(b)
+        return b
+
+    @async_test
+    async def test_lazy_after_manifest(self):
+        # No manifest yet, everything loads and gets described.
+        b = self.make_bot()
+        await b._loader.watch_spec("extension_test_data.*")
+        self.assertIn("UsesUsesCommon", b.cogs)
+        await b.close()
+
+        b = self.make_bot()
+        await b._loader.watch_spec("extension_test_data.*")
+        self.assertNotIn("UsesUsesCommon", b.cogs)
+        self.assertNotIn("extension_test_data.depends_noimport", b.extensions)
+        self.assertIn("a_command_here", b.all_commands)
+
+        await b._loader._register.lazy.load("extension_test_data.depends_noimport")
+        self.assertIn("UsesUsesCommon", b.cogs)
+        self.assertIn("UsesCommon", b.cogs)
+        self.assertIs(b.cogs["UsesUsesCommon"], b.get_command("a_command_here").cog)
+
 
 if __name__ == "__main__":
     unittest.main()
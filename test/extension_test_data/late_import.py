@@ -0,0 +1,12 @@
+"""Only imports common by name and inside a function."""
+from dango import dcog, Cog
+
+from .common.extras import some_extra
+
+
+@dcog()
+class LateImport(Cog):
+    def __init__(self, config):
+        from .common import utils
+        self.b = utils.dummy()
+        self.c = some_extra(1, 2)
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from dango.extras import gateway_trace
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        coro = f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro)
+    return wrapper
+
+
+class TestTraceFile(unittest.TestCase):
+
+    @async_test
+    async def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "gateway.trace.gz")
+            writer = gateway_trace.TraceWriter(filename)
+            writer.emit('{"op": 10, "d": {"heartbeat_interval": 41250}}')
+            await writer.flush()
+            writer.emit(b'{"op": 0, "t": "MESSAGE_CREATE", "d": {"content": "a\\tb"}}')
+            await writer.close()
+
+            trace = list(gateway_trace.read_trace(filename))
+        self.assertEqual(2, writer.events)
+        self.assertEqual([
+            '{"op": 10, "d": {"heartbeat_interval": 41250}}',
+            '{"op": 0, "t": "MESSAGE_CREATE", "d": {"content": "a\\tb"}}',
+        ], [raw for _, raw in trace])
+        self.assertLessEqual(trace[0][0], trace[1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
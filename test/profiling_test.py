@@ -0,0 +1,43 @@
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+
+from dango import profiling
+
+
+class ImportTimerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, "profiling_outer.py"), "w") as f:
+            f.write("import time\nimport profiling_inner\ntime.sleep(0.02)\n")
+        with open(os.path.join(self.tmp.name, "profiling_inner.py"), "w") as f:
+            f.write("import time\ntime.sleep(0.05)\n")
+        sys.path.insert(0, self.tmp.name)
+
+    def tearDown(self):
+        sys.path.remove(self.tmp.name)
+        for name in ("profiling_outer", "profiling_inner"):
+            sys.modules.pop(name, None)
+        self.tmp.cleanup()
+
+    def test_self_and_total(self):
+        times = {}
+        with profiling.ImportTimer(times):
+            mod = importlib.import_module("profiling_outer")
+
+        outer_self, outer_total = times["profiling_outer"]
+        inner_self, inner_total = times["profiling_inner"]
+        self.assertGreaterEqual(inner_self, 0.05)
+        self.assertAlmostEqual(inner_self, inner_total)
+        self.assertGreaterEqual(outer_total, 0.07)
+        self.assertLess(outer_self, 0.05)
+        # The timing loader doesn't stick around.
+        self.assertNotIsInstance(mod.__loader__, profiling._TimedLoader)
+        self.assertNotIn(profiling.ImportTimer, map(type, sys.meta_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import json
+import unittest
+
+from dango.plugins.common import serialization
+
+
+SAMPLE_DOCUMENT = {
+    "osu_id": 2070907,
+    "blizzard_battletag": "khazhyk#1234",
+    "resin_count": 120,
+    "resin_date": 1633046400.123,
+    "pm_mentions_mode": "always",
+}
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for codec in serialization.CODECS.values():
+            encoded = serialization.encode(SAMPLE_DOCUMENT, codec)
+            self.assertEqual(codec.version, encoded[0])
+            self.assertEqual(SAMPLE_DOCUMENT, serialization.decode(encoded))
+
+    def test_legacy_json(self):
+        legacy = json.dumps(SAMPLE_DOCUMENT).encode('utf8')
+        self.assertEqual(SAMPLE_DOCUMENT, serialization.decode(legacy))
+        self.assertEqual(SAMPLE_DOCUMENT, serialization.decode(legacy.decode('utf8')))
+
+    def test_msgpack_smaller(self):
+        self.assertLess(
+            len(serialization.encode(SAMPLE_DOCUMENT, serialization.get_codec("msgpack"))),
+            len(serialization.encode(SAMPLE_DOCUMENT, serialization.get_codec("json"))))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            serialization.get_codec("pickle")
+
+
+if __name__ == "__main__":
+    unittest.main()
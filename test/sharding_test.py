@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import fnmatch
+import unittest
+
+from dango.plugins.common import sharding
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        coro = f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro)
+    return wrapper
+
+
+class FakeRedis:
+    """Just enough of a redis client, backed by a dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = collections.Counter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def get(self, key):
+        self.calls["get"] += 1
+        return self.data.get(key)
+
+    async def set(self, key, value):
+        self.data[key] = value
+        return True
+
+    async def mget(self, keys):
+        self.calls["mget"] += 1
+        return [self.data.get(key) for key in keys]
+
+    async def mset(self, mapping):
+        self.calls["mset"] += 1
+        self.data.update(mapping)
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    async def flushdb(self):
+        self.data.clear()
+        return True
+
+    async def scan(self, cursor, match=None, count=None):
+        keys = sorted(self.data)
+        cursor = int(cursor)
+        page = keys[cursor:cursor + (count or 10)]
+        next_cursor = cursor + len(page)
+        if next_cursor >= len(keys):
+            next_cursor = 0
+        return next_cursor, [k for k in page if not match or fnmatch.fnmatch(k, match)]
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_distribution(self):
+        ring = sharding.HashRing(["a:6379/0", "b:6379/0", "c:6379/0"])
+        counts = collections.Counter(
+            ring.index("spoo:last_username:%d" % i) for i in range(30000))
+        for idx in range(3):
+            self.assertGreater(counts[idx], 7000)
+
+    def test_adding_node_moves_few_keys(self):
+        keys = ["spoo:last_username:%d" % i for i in range(10000)]
+        before = sharding.HashRing(["a", "b", "c"])
+        after = sharding.HashRing(["a", "b", "c", "d"])
+        moved = sum(
+            before.nodes[before.index(k)] != after.nodes[after.index(k)] for k in keys)
+        # Ideally a quarter move, all of them to the new node.
+        self.assertLess(moved, 4000)
+        for k in keys:
+            if before.nodes[before.index(k)] != after.nodes[after.index(k)]:
+                self.assertEqual("d", after.nodes[after.index(k)])
+
+
+class TestShardedClient(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = [FakeRedis() for _ in range(3)]
+        self.client = sharding.ShardedClient(
+            self.nodes, sharding.HashRing(["a", "b", "c"]))
+
+    @async_test
+    async def test_single_key_routing(self):
+        await self.client.set("spoo:x", b"1")
+        self.assertEqual(b"1", await self.client.get("spoo:x"))
+        self.assertEqual(1, sum(bool(node.data) for node in self.nodes))
+
+    @async_test
+    async def test_mget_mset_fan_out(self):
+        mapping = {"spoo:last_username:%d" % i: str(i).encode() for i in range(300)}
+        await self.client.mset(mapping)
+        for node in self.nodes:
+            self.assertEqual(1, node.calls["mset"])
+            self.assertTrue(node.data)
+
+        keys = list(mapping) + ["spoo:missing"]
+        # Called the way Tracking.batch_get_redis_mismatch calls it.
+        values = await self.client.mget(*keys)
+        self.assertEqual(list(mapping.values()) + [None], values)
+        self.assertEqual(3, sum(node.calls["mget"] for node in self.nodes))
+
+    @async_test
+    async def test_delete_exists(self):
+        await self.client.mset({"a": b"1", "b": b"2", "c": b"3"})
+        self.assertEqual(3, await self.client.exists("a", "b", "c", "d"))
+        self.assertEqual(2, await self.client.delete("a", "b"))
+        self.assertEqual(1, await self.client.exists("a", "b", "c"))
+
+    @async_test
+    async def test_scan_all_nodes(self):
+        mapping = {"spoo:last_seen:%d" % i: b"" for i in range(100)}
+        mapping["other"] = b""
+        await self.client.mset(mapping)
+
+        found = []
+        cur = b'0'
+        while cur:
+            cur, keys = await self.client.scan(cur, match="spoo:last_seen:*", count=7)
+            found.extend(keys)
+        self.assertEqual(sorted(k for k in mapping if k != "other"), sorted(found))
+
+    @async_test
+    async def test_flushdb(self):
+        await self.client.mset({"a": b"1", "b": b"2", "c": b"3"})
+        async with self.client as conn:
+            await conn.flushdb()
+        self.assertFalse(any(node.data for node in self.nodes))
+
+
+if __name__ == "__main__":
+    unittest.main()
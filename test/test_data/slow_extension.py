@@ -0,0 +1,30 @@
+import asyncio
+
+from dango import dcog, Cog
+
+
+@dcog()
+class SlowA(Cog):
+    def __init__(self, config):
+        pass
+
+    async def cog_load(self):
+        await asyncio.sleep(0.2)
+
+
+@dcog()
+class SlowB(Cog):
+    def __init__(self, config):
+        pass
+
+    async def cog_load(self):
+        await asyncio.sleep(0.2)
+
+
+@dcog(depends=["SlowA"])
+class SlowC(Cog):
+    def __init__(self, config, a):
+        self.a = a
+
+    async def cog_load(self):
+        await asyncio.sleep(0.2)
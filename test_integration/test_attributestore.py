@@ -0,0 +1,117 @@
+import asyncio
+import random
+import unittest
+
+from dango import config
+import discord
+from dango.plugins import attributestore
+from dango.plugins import database
+from dango.plugins import redis
+
+
+conf = config.StringConfiguration("""
+database:
+  dsn: postgresql://@localhost/spootest
+redis:
+  db: 5
+attribute_store:
+  warmup_count: 100
+""")
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        coro = f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro)
+    return wrapper
+
+
+def user():
+    return discord.Object(random.randint(1 << 10, 1 << 58))
+
+
+class TestAttributeStore(unittest.TestCase):
+    @classmethod
+    @async_test
+    async def setUpClass(cls):
+        cls.db = database.Database(conf.root.add_group("database"))
+        cls.rds = redis.Redis(conf.root.add_group("redis"))
+        await cls.db.cog_load()
+        await cls.rds.cog_load()
+
+    @classmethod
+    @async_test
+    async def tearDownClass(cls):
+        await cls.db.cog_unload()
+        await cls.rds.cog_unload()
+
+    @async_test
+    async def setUp(self):
+        async with self.db.acquire() as conn:
+            await conn.execute("delete from attributes")
+        async with self.rds.acquire() as conn:
+            await conn.flushdb()
+        self.attr = attributestore.AttributeStore(
+            conf.root.add_group("attribute_store"), self.db, self.rds)
+        self.attr.register_mapping(discord.Object, 'member')
+
+    @async_test
+    async def test_roundtrip(self):
+        u = user()
+        await self.attr.set_attributes(u, osu_id=123, pm_mentions_mode="always")
+
+        self.attr._lru.clear()
+        self.assertEqual(123, await self.attr.get_attribute(u, "osu_id"))
+
+        async with self.rds.acquire() as conn:
+            await conn.flushdb()
+        self.attr._lru.clear()
+        self.assertEqual("always", await self.attr.get_attribute(u, "pm_mentions_mode"))
+
+    @async_test
+    async def test_find(self):
+        users = [user() for _ in range(10)]
+        for u in users[:5]:
+            await self.attr.set_attributes(u, pm_mentions_mode="always")
+        for u in users[5:]:
+            await self.attr.set_attributes(u, pm_mentions_mode="off")
+
+        found = [i async for i in self.attr.find('member', 'pm_mentions_mode', 'always')]
+        self.assertEqual(sorted(u.id for u in users[:5]), sorted(found))
+
+    @async_test
+    async def test_find_reverse_cache_invalidation(self):
+        self.attr.register_reverse_key('member', 'osu_id')
+        u = user()
+        await self.attr.set_attributes(u, osu_id=1)
+
+        self.assertEqual([u.id], [i async for i in self.attr.find('member', 'osu_id', 1)])
+
+        await self.attr.set_attributes(u, osu_id=2)
+        self.assertEqual([], [i async for i in self.attr.find('member', 'osu_id', 1)])
+        self.assertEqual([u.id], [i async for i in self.attr.find('member', 'osu_id', 2)])
+
+    @async_test
+    async def test_warmup(self):
+        users = [user() for _ in range(10)]
+        for u in users:
+            await self.attr.set_attributes(u, osu_id=u.id)
+            await self.attr.get(u)
+        await self.attr.do_batch_access_update()
+
+        async with self.rds.acquire() as conn:
+            await conn.flushdb()
+        self.attr._lru.clear()
+
+        await self.attr.warmup(100, 3)
+
+        async with self.rds.acquire() as conn:
+            for u in users:
+                self.assertIsNotNone(await conn.get(attributestore._redis_key('member', u.id)))
+        for u in users:
+            self.assertEqual({"osu_id": u.id}, await self.attr._get_lru('member', u.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from dango import config
+from dango.plugins import redis
+
+
+conf = config.StringConfiguration("""
+redis:
+  db: 5
+  near_cache:
+    "spoo:test:": {size: 100, ttl: 60}
+uncached_redis:
+  db: 5
+""")
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        coro = f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coro)
+    return wrapper
+
+
+class TestNearCache(unittest.TestCase):
+
+    @async_test
+    async def setUp(self):
+        self.rds = redis.Redis(conf.root.add_group("redis"))
+        self.other = redis.Redis(conf.root.add_group("uncached_redis"))
+        await self.rds.cog_load()
+        await self.other.cog_load()
+        async with self.other.acquire() as conn:
+            await conn.config_set("notify-keyspace-events", "K$gx")
+            await conn.flushdb()
+        await asyncio.sleep(0.1)  # Let the invalidator subscribe
+
+    @async_test
+    async def tearDown(self):
+        await self.rds.cog_unload()
+        await self.other.cog_unload()
+
+    @async_test
+    async def test_hits(self):
+        prefix = self.rds._near_cache.prefixes[0]
+        async with self.rds.acquire() as conn:
+            await conn.set("spoo:test:a", b"1")
+            self.assertEqual(b"1", await conn.get("spoo:test:a"))
+            self.assertEqual(b"1", await conn.get("spoo:test:a"))
+            self.assertEqual([b"1", None], await conn.mget("spoo:test:a", "spoo:test:b"))
+        self.assertEqual(2, prefix.hits)
+        self.assertEqual(2, prefix.misses)
+
+    @async_test
+    async def test_uncached_prefix(self):
+        prefix = self.rds._near_cache.prefixes[0]
+        async with self.rds.acquire() as conn:
+            await conn.set("spoo:other:a", b"1")
+            self.assertEqual(b"1", await conn.get("spoo:other:a"))
+        self.assertEqual(0, prefix.hits + prefix.misses)
+
+    @async_test
+    async def test_invalidated_by_other_client(self):
+        async with self.rds.acquire() as conn:
+            await conn.set("spoo:test:a", b"1")
+            self.assertEqual(b"1", await conn.get("spoo:test:a"))
+
+        async with self.other.acquire() as conn:
+            await conn.set("spoo:test:a", b"2")
+        await asyncio.sleep(0.1)
+
+        async with self.rds.acquire() as conn:
+            self.assertEqual(b"2", await conn.get("spoo:test:a"))
+
+
+if __name__ == '__main__':
+    unittest.main()